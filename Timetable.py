@@ -8,21 +8,36 @@
     time_addition - фукнция сложения даты и времени
     get_destination - возвращает все города, куда есть рейсы из заданного города
     dict_formatter - функция форматирования словаря в строку
+    city_index - индекс нечеткого поиска по списку городов
+    Route - расписание одного маршрута с выборкой вылетов по дням
+    get_routes - все маршруты расписания, загружаются один раз на версию файла
+    get_date_window - рейсы по нескольким маршрутам в окне ±N дней, сгруппированные по дням
+    calendar_formatter - форматирование окна дат в компактный календарь с нумерацией рейсов
+    window_flights - рейсы окна дат в порядке нумерации calendar_formatter
 """
 
+import bisect
 import datetime
 import csv
+import functools
+import os
 from pathlib import Path
-import pandas
 from os.path import normpath
+from city_search import CitySearch
 
 
 ENDINGS = ['а', 'ь', 'е', 'ы', 'я', 'у', 'ки', 'и']
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 DATETIME = '%d-%m-%Y %H:%M'
 DATE = '%d-%m-%Y'
 TIME = '%H:%M'
 
+SUGGESTIONS = 5
+WINDOW_DAYS = 3
+
 BASEDIR = Path(__file__).resolve().parent
+# Файл расписания, создается модулем timetable_creation
+FLIGHTS = BASEDIR/'files/flights.csv'
 
 
 def get_departure_city():
@@ -35,7 +50,7 @@ def get_departure_city():
     #  Ведь, для одной ОС, разделителем в директории является "/", а в другой "\".
     #  Предлагаю создавать директорию при помощи os.path.
     #  Возможно, в таком случае, мы сможем решить без использования модуля pathlib.
-    with open(file=normpath(BASEDIR/'files/flights.csv'), mode='r', encoding='utf8') as ff:
+    with open(file=normpath(FLIGHTS), mode='r', encoding='utf8') as ff:
         # скипаю первую строку
         next(ff)
         reader = csv.reader(ff)
@@ -50,7 +65,7 @@ def get_destination_city():
 
     @return: множество всех городов куда есть рейсы
     """
-    with open(file=normpath(BASEDIR/'files/flights.csv'), mode='r', encoding='utf8') as ff:
+    with open(file=normpath(FLIGHTS), mode='r', encoding='utf8') as ff:
         next(ff)
         reader = csv.reader(ff)
         destination = set([row[1] for row in reader])
@@ -78,47 +93,32 @@ def reformat_city(cities: list):
     return result
 
 
-def get_date(dep: str, dest: str, date: str):
+def get_date(dep: str, dest: str, date: str, min_seats: int = 0):
     """
-    Функция получения 5 ближайших к дате рейсов
+    Функция получения 5 ближайших к дате рейсов.
+    Рейсы берутся из того же индекса Route, что и окно get_date_window, поэтому оба списка совпадают
 
     @param dep: город отправления
     @param dest: город назначения
     @param date: дата полученная от пользователя
+    @param min_seats: если больше 0, пропускаются рейсы, где свободных мест меньше
     @return: 5 ближайших к дате рейсов
     """
-    result, period_date = [[] for _ in range(2)]
-    # Список именованных дней недели
-    weekdays = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    # Просматриваю документ с распианием, ищу все полеты между городами
-    with open(file=normpath(BASEDIR/'files/flights.csv'), mode='r', encoding='utf8') as ff:
-        reader = csv.reader(ff)
-        pairs = [row for row in reader if (dep, dest) == (row[0], row[1])]
-
-    # Найденные пути делю на переодичные и случайные рейсы
-    for depart, destin, time, period in pairs:
-        if period.isdigit() or period in weekdays:
-            period_date.append((time, period))
-        else:
-            if datetime.datetime.strptime(time, DATETIME) >= datetime.datetime.strptime(date, DATE):
-                result.append(time)
-
-    # Устанавливаю промежуток размером в месяц, начиная с введенной пользователем даты
-    date_parse = datetime.datetime.strptime(date, DATE)
-    last_date = date_parse + datetime.timedelta(days=30)
-
-    days = pandas.date_range(date_parse, last_date, freq='D')
-    # Среди дней ищу те, которые совпадают с переодичностью
-    for day in days:
-        day_parse = datetime.datetime.strptime(str(day), '%Y-%m-%d %H:%M:%S')
-        day_week = weekdays[day_parse.weekday()]
+    route = get_routes().get((dep, dest))
+    if route is None:
+        return []
 
-        for time, day in period_date:
-            if day_week == day or day_parse == day:
-                result.append(time_addition(day_parse, time))
+    # Переодичные рейсы ищутся в промежутке размером в месяц, начиная с введенной пользователем даты,
+    # случайные - на любую дату не раньше введенной
+    start = datetime.datetime.strptime(date, DATE)
+    result = route.departures(start.date(), start.date() + datetime.timedelta(days=30))
+    result += route.dates[bisect.bisect_left(route.dates, start + datetime.timedelta(days=31)):]
 
-    # Сортирую по возрастанию и возвращаю 5 ближайших
-    return sorted(result, key=lambda d: datetime.datetime.strptime(d, DATETIME))[:5]
+    if min_seats:
+        # Импорт здесь, чтобы модуль расписания не зависел от базы данных
+        import seats
+        result = seats.filter_available(dep, dest, result, min_seats)
+    return [departure.strftime(DATETIME) for departure in result[:5]]
 
 
 def time_addition(date: datetime.date, time: datetime.time):
@@ -142,7 +142,7 @@ def get_destination(dep_city: str):
     @param dep_city: город отправления
     @return: множество городов в которые есть рейсы из dep_city
     """
-    with open(file=normpath(BASEDIR/'files/flights.csv'), mode='r', encoding='utf8') as ff:
+    with open(file=normpath(FLIGHTS), mode='r', encoding='utf8') as ff:
         reader = csv.reader(ff)
         result = [row[1] for row in reader if row[0] == dep_city]
 
@@ -159,4 +159,154 @@ def dict_formatter(dates: dict):
     2) date
     3) date
     """
-    return '\n'.join(f'{index}) {date}' for index, date in enumerate(dates, 1))
\ No newline at end of file
+    return '\n'.join(f'{index}) {date}' for index, date in enumerate(dates, 1))
+
+
+@functools.lru_cache(maxsize=128)
+def _city_index(cities: tuple):
+    return CitySearch(cities)
+
+
+def city_index(cities: list):
+    """
+    Функция получения индекса нечеткого поиска по городам.
+    Индекс строится один раз для каждого набора городов и переиспользуется между сообщениями
+
+    @param cities: список городов
+    @return: CitySearch по этим городам
+    """
+    return _city_index(tuple(sorted(set(cities))))
+
+
+class Route:
+    """
+    Класс расписания маршрута между двумя городами.
+    Хранит переодичные рейсы как (день недели/месяца, время) и отсортированный список случайных рейсов,
+    поэтому вылеты за день находятся без перебора всего расписания.
+    """
+
+    def __init__(self, departure_city, destination_city):
+        self.departure_city, self.destination_city = departure_city, destination_city
+        self.weekly, self.monthly, self.dates = [], [], []
+
+    def add(self, time: str, period: str):
+        if period in WEEKDAYS:
+            self.weekly.append((WEEKDAYS.index(period), datetime.datetime.strptime(time, TIME).time()))
+        elif period.isdigit():
+            self.monthly.append((int(period), datetime.datetime.strptime(time, TIME).time()))
+        else:
+            bisect.insort(self.dates, datetime.datetime.strptime(time, DATETIME))
+
+    def departures_on(self, day: datetime.date):
+        """
+        Функция получения всех вылетов за день
+
+        @param day: день
+        @return: отсортированный список datetime вылетов
+        """
+        times = [time for weekday, time in self.weekly if weekday == day.weekday()]
+        times += [time for monthday, time in self.monthly if monthday == day.day]
+        result = [datetime.datetime.combine(day, time) for time in times]
+
+        start = datetime.datetime.combine(day, datetime.time())
+        end = start + datetime.timedelta(days=1)
+        result += self.dates[bisect.bisect_left(self.dates, start):bisect.bisect_left(self.dates, end)]
+
+        return sorted(result)
+
+    def departures(self, first: datetime.date, last: datetime.date):
+        """
+        Функция получения всех вылетов за период
+
+        @param first: первый день
+        @param last: последний день включительно
+        @return: отсортированный список datetime вылетов
+        """
+        result = []
+        for offset in range((last - first).days + 1):
+            result += self.departures_on(first + datetime.timedelta(days=offset))
+        return result
+
+
+@functools.lru_cache(maxsize=1)
+def _load_routes(path: str, mtime: float):
+    routes = {}
+    with open(file=path, mode='r', encoding='utf8') as ff:
+        next(ff)
+        for depart, destin, time, period in csv.reader(ff):
+            route = routes.get((depart, destin))
+            if route is None:
+                route = routes[(depart, destin)] = Route(depart, destin)
+            route.add(time, period)
+    return routes
+
+
+def get_routes():
+    """
+    Функция получения всех маршрутов расписания.
+    Файл разбирается один раз и перечитывается, только если он изменился
+
+    @return: словарь {(город отправления, город назначения): Route}
+    """
+    path = normpath(FLIGHTS)
+    return _load_routes(path, os.path.getmtime(path))
+
+
+def get_date_window(routes: list, date: str, days: int = 3):
+    """
+    Функция получения рейсов по нескольким маршрутам в окне дат за один проход.
+    Прошедшие дни в окно не попадают
+
+    @param routes: список пар (город отправления, город назначения)
+    @param date: дата в формате '%d-%m-%Y', центр окна
+    @param days: ширина окна в каждую сторону
+    @return: словарь {дата '%d-%m-%Y': {(отправление, назначение): [время '%H:%M', ...]}}, только дни с рейсами
+    """
+    timetable = get_routes()
+    routes = [timetable[route] for route in routes if route in timetable]
+    center = datetime.datetime.strptime(date, DATE).date()
+    first = max(center - datetime.timedelta(days=days), datetime.date.today())
+
+    result = {}
+    for offset in range((center + datetime.timedelta(days=days) - first).days + 1):
+        day = first + datetime.timedelta(days=offset)
+        flights = {}
+        for route in routes:
+            departures = route.departures_on(day)
+            if departures:
+                flights[(route.departure_city, route.destination_city)] = [d.strftime(TIME) for d in departures]
+        if flights:
+            result[day.strftime(DATE)] = flights
+
+    return result
+
+
+def calendar_formatter(window: dict, start: int = 1):
+    """
+    Функция форматирования окна дат с нумерацией рейсов
+
+    @param window: результат get_date_window
+    @param start: номер первого рейса
+    @return: строки вида 'dd-mm-YYYY: 1) HH:MM, 2) HH:MM', для нескольких маршрутов с указанием маршрута.
+    Рейсы нумеруются в порядке window_flights
+    """
+    lines, number = [], start
+    routes = {route for flights in window.values() for route in flights}
+    for day, flights in window.items():
+        parts = []
+        for (dep, dest), times in flights.items():
+            numbered = ', '.join(f'{index}) {time}' for index, time in enumerate(times, number))
+            number += len(times)
+            parts.append(numbered if len(routes) == 1 else f'{dep} - {dest} {numbered}')
+        lines.append('{}: {}'.format(day, '; '.join(parts)))
+    return '\n'.join(lines)
+
+
+def window_flights(window: dict):
+    """
+    Функция получения рейсов окна в том порядке, в котором их нумерует calendar_formatter
+
+    @param window: результат get_date_window
+    @return: список рейсов в формате '%d-%m-%Y %H:%M'
+    """
+    return [f'{day} {time}' for day, flights in window.items() for times in flights.values() for time in times]
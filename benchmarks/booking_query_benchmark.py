@@ -0,0 +1,118 @@
+"""
+Бенчмарк выборок броней на синтетической таблице билетов в SQLite:
+запросы модуля bookings по индексам и счетчикам против тех же выборок полным просмотром таблицы
+
+Запуск из корня проекта: python benchmarks/booking_query_benchmark.py [количество билетов] [файл базы]
+"""
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pony.orm import db_session  # noqa: E402
+
+import bookings  # noqa: E402
+from models import db, init_db  # noqa: E402
+
+CITIES = ['Москва', 'Берлин', 'Рига', 'Париж', 'Прага', 'Рим', 'Вена', 'Лондон', 'Мадрид', 'Осло']
+USERS = 50000
+START = datetime.datetime(2021, 1, 1)
+DAYS = 365
+REPEAT = 200
+
+
+def fill(count):
+    """
+    Функция заполнения таблицы билетов. Строки вставляются напрямую через executemany,
+    а счетчики строятся bookings.rebuild_stats, как при переносе существующей базы
+    """
+    rnd = random.Random(0)
+    rows = []
+    for _ in range(count):
+        dep, dest = rnd.sample(CITIES, 2)
+        date = START + datetime.timedelta(days=rnd.randrange(DAYS), minutes=rnd.randrange(0, 1440, 5))
+        rows.append((str(rnd.randrange(USERS)), dep, dest, date.strftime('%Y-%m-%d %H:%M:%S'),
+                     rnd.randint(1, 5), 'коммент', '[]'))
+
+    with db_session:
+        connection = db.get_connection()
+        connection.executemany('INSERT INTO "Ticket" (user_id, departure_city, destination_city, date, ticket_count, '
+                               'commentary, seats) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        bookings.rebuild_stats()
+
+
+def bench(name, function, repeat=REPEAT):
+    rnd = random.Random(1)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(rnd)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'{name:<40} {elapsed * 1000:>9.3f} ms')
+    return elapsed
+
+
+def scan(sql):
+    """
+    Функция построения того же запроса без индексов (NOT INDEXED), для сравнения с полным просмотром
+    """
+    def run(rnd):
+        dep, dest = rnd.sample(CITIES, 2)
+        day = START + datetime.timedelta(days=rnd.randrange(DAYS))
+        params = {'user': str(rnd.randrange(USERS)), 'dep': dep, 'dest': dest,
+                  'start': day.strftime('%Y-%m-%d'), 'end': (day + datetime.timedelta(days=1)).strftime('%Y-%m-%d')}
+        with db_session:
+            db.get_connection().execute(sql, params).fetchall()
+    return run
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    filename = sys.argv[2] if len(sys.argv) > 2 else os.path.join(tempfile.mkdtemp(), 'bookings.sqlite')
+    init_db(dict(provider='sqlite', filename=filename, create_db=True))
+
+    start = time.perf_counter()
+    fill(count)
+    print(f'{count} билетов записано за {time.perf_counter() - start:.1f} s в {filename}')
+
+    def random_route(rnd):
+        dep, dest = rnd.sample(CITIES, 2)
+        return dep, dest, START + datetime.timedelta(days=rnd.randrange(DAYS))
+
+    def user_tickets(rnd):
+        bookings.user_tickets(rnd.randrange(USERS))
+
+    def route_tickets(rnd):
+        dep, dest, day = random_route(rnd)
+        bookings.route_tickets(dep, dest, day, day + datetime.timedelta(days=1))
+
+    def route_stats(rnd):
+        dep, dest, day = random_route(rnd)
+        bookings.route_stats(dep, dest, day.date(), day.date() + datetime.timedelta(days=30))
+
+    def totals(rnd):
+        day = random_route(rnd)[2].date()
+        bookings.daily_totals(day, day + datetime.timedelta(days=30))
+
+    print('Индексы и счетчики:')
+    bench('user_tickets', user_tickets)
+    bench('route_tickets (1 день)', route_tickets)
+    bench('route_stats (30 дней)', route_stats)
+    bench('daily_totals (30 дней)', totals)
+
+    print('Полный просмотр таблицы:')
+    bench('билеты пользователя', scan('SELECT * FROM "Ticket" NOT INDEXED WHERE user_id = :user ORDER BY date'), 5)
+    bench('билеты маршрута за день', scan('SELECT * FROM "Ticket" NOT INDEXED WHERE departure_city = :dep '
+                                          'AND destination_city = :dest AND date >= :start AND date < :end'), 5)
+    bench('статистика маршрута за день', scan('SELECT count(*), sum(ticket_count) FROM "Ticket" NOT INDEXED '
+                                              'WHERE departure_city = :dep AND destination_city = :dest '
+                                              'AND date >= :start AND date < :end'), 5)
+
+
+if __name__ == '__main__':
+    main()
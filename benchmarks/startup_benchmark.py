@@ -0,0 +1,84 @@
+"""
+Бенчмарк холодного старта: время импорта модуля bot по отчету python -X importtime
+
+Запуск из корня проекта:
+    python benchmarks/startup_benchmark.py                 - отчет по самым тяжелым импортам
+    python benchmarks/startup_benchmark.py --save FILE     - сохранить результат как эталон
+    python benchmarks/startup_benchmark.py --compare FILE  - сравнить с эталоном, код 1 при замедлении
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASEDIR = Path(__file__).resolve().parent.parent
+# Модули, которые не должны загружаться при импорте бота
+HEAVY = ('pandas', 'numpy', 'PIL')
+
+
+def import_time(module):
+    """
+    Функция замера импорта модуля в отдельном процессе
+
+    @param module: имя модуля
+    @return: (общее время импорта в мкс, {пакет: накопленное время в мкс})
+    """
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                             cwd=BASEDIR, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, total, name = line[len('import time:'):].split('|')
+        cumulative[name.strip()] = int(total)
+
+    return cumulative[module], cumulative
+
+
+def run(module, repeat):
+    totals, reports = [], []
+    for _ in range(repeat):
+        total, report = import_time(module)
+        totals.append(total)
+        reports.append(report)
+
+    return {'module': module,
+            'median_us': int(statistics.median(totals)),
+            'heavy': sorted({name for report in reports for name in report if name.split('.')[0] in HEAVY}),
+            'top': sorted(reports[-1].items(), key=lambda item: -item[1])[:15]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--module', default='bot')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save')
+    parser.add_argument('--compare')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='допустимое замедление относительно эталона')
+    args = parser.parse_args()
+
+    result = run(args.module, args.repeat)
+    print(f"import {result['module']}: {result['median_us'] / 1000:.1f} ms (медиана из {args.repeat})")
+    for name, total in result['top']:
+        print(f'{total / 1000:>10.1f} ms  {name}')
+    if result['heavy']:
+        print('Тяжелые модули в цепочке импорта:', ', '.join(result['heavy']))
+
+    if args.save:
+        with open(args.save, mode='w', encoding='utf8') as ff:
+            json.dump(result, ff, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, mode='r', encoding='utf8') as ff:
+            baseline = json.load(ff)
+        limit = baseline['median_us'] * (1 + args.tolerance)
+        print(f"эталон: {baseline['median_us'] / 1000:.1f} ms, предел: {limit / 1000:.1f} ms")
+        if result['median_us'] > limit or result['heavy']:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Бенчмарк генерации билетов: TicketCreator (ImageDraw.text) против LayeredTicketCreator (кэш слоев),
+с кодированием png на одинаковом уровне сжатия и без него
+
+Запуск из корня проекта: python benchmarks/ticket_render_benchmark.py [количество билетов]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ticket_create import TicketCreator, LayeredTicketCreator  # noqa: E402
+
+DATA = {'user_name': 'Дмитрий Смирнов',
+        'departure_city': 'Москва',
+        'destination_city': 'Берлин',
+        'date': '10-08-2021 07:54',
+        'ticket_count': 3}
+
+
+def bench(creator_class, count, method='create', compress_level=None):
+    """
+    Функция замера скорости генерации билетов
+
+    @param creator_class: класс генерации билетов
+    @param count: количество билетов
+    @param method: вызываемый метод: 'create' - с кодированием png, 'render' - только отрисовка
+    @param compress_level: уровень сжатия png, None - уровень класса
+    @return: билетов в секунду
+    """
+    start = time.perf_counter()
+    for _ in range(count):
+        creator = creator_class(DATA)
+        if compress_level is not None:
+            creator.COMPRESS_LEVEL = compress_level
+        if method == 'create':
+            creator.create()
+        else:
+            creator.render(creator.generate_tickets())
+    return count / (time.perf_counter() - start)
+
+
+def main(count=200):
+    LayeredTicketCreator.warm([DATA['departure_city'], DATA['destination_city']])
+
+    # Оба класса сравниваются при одинаковом уровне сжатия, чтобы выигрыш слоев не смешивался с выигрышем кодирования
+    print(f'{"renderer":<40}{"tickets/sec":>12}')
+    for level in (TicketCreator.COMPRESS_LEVEL, LayeredTicketCreator.COMPRESS_LEVEL):
+        for creator_class in (TicketCreator, LayeredTicketCreator):
+            name = f'{creator_class.__name__}.create (level {level})'
+            print(f'{name:<40}{bench(creator_class, count, compress_level=level):>12.1f}')
+    for creator_class in (TicketCreator, LayeredTicketCreator):
+        name = f'{creator_class.__name__}.render (no png)'
+        print(f'{name:<40}{bench(creator_class, count, "render"):>12.1f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
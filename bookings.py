@@ -0,0 +1,144 @@
+"""
+Модуль записи и выборки броней
+
+    add_ticket - создание билета и обновление счетчиков маршрута за день
+    rebuild_stats - пересчет счетчиков по всей таблице билетов
+    user_tickets - билеты пользователя
+    last_ticket - последняя бронь пользователя
+    route_tickets - билеты на маршрут за период
+    route_stats - количество броней и билетов маршрута по дням
+    daily_totals - количество броней и билетов по всем маршрутам по дням
+    top_routes - самые популярные маршруты за период
+
+Выборки билетов используют составные индексы models.Ticket, а статистика читается из models.RouteDayStats
+и не просматривает таблицу билетов. add_ticket и rebuild_stats нужно вызывать внутри db_session.
+"""
+
+import datetime
+
+from pony.orm import db_session, select, count, desc, sum as pony_sum
+
+from models import Ticket, RouteDayStats, insert_missing
+
+
+def add_ticket(user_id, departure_city: str, destination_city: str, date: datetime.datetime,
+               ticket_count: int, commentary: str, seats: list = None):
+    """
+    Функция создания билета. Строка счетчиков сначала вставляется, если ее нет, и затем блокируется
+    через SELECT ... FOR UPDATE, поэтому параллельные брони на тот же маршрут не теряют увеличения,
+    в том числе первая бронь на день
+
+    @return: созданный Ticket
+    """
+    insert_missing(RouteDayStats, departure_city=departure_city, destination_city=destination_city,
+                   day=date.date(), bookings=0, tickets=0)
+    stats = RouteDayStats.get_for_update(departure_city=departure_city, destination_city=destination_city,
+                                         day=date.date())
+
+    ticket = Ticket(user_id=str(user_id), departure_city=departure_city, destination_city=destination_city,
+                    date=date, ticket_count=ticket_count, commentary=commentary, seats=seats)
+    stats.bookings += 1
+    stats.tickets += int(ticket_count)
+    return ticket
+
+
+def rebuild_stats():
+    """
+    Функция пересчета счетчиков одним запросом GROUP BY. Нужна для заполнения RouteDayStats
+    по билетам, созданным до появления счетчиков
+    """
+    query = select((t.departure_city, t.destination_city, t.date.date(), count(t), pony_sum(t.ticket_count))
+                   for t in Ticket)
+    totals = {(dep, dest, day): (bookings, tickets) for dep, dest, day, bookings, tickets in query}
+
+    # Существующие строки обновляются, а не удаляются, чтобы не конфликтовать с объектами в кэше сессии
+    for stats in RouteDayStats.select():
+        key = (stats.departure_city, stats.destination_city, stats.day)
+        if key in totals:
+            stats.bookings, stats.tickets = totals.pop(key)
+        else:
+            stats.delete()
+
+    for (dep, dest, day), (bookings, tickets) in totals.items():
+        RouteDayStats(departure_city=dep, destination_city=dest, day=day, bookings=bookings, tickets=tickets)
+
+
+@db_session
+def user_tickets(user_id, since: datetime.datetime = None, limit: int = 20):
+    """
+    Функция получения билетов пользователя
+
+    @param user_id: id пользователя
+    @param since: только вылеты не раньше этой даты
+    @param limit: максимальное количество билетов
+    @return: список словарей билетов, отсортированный по дате вылета
+    """
+    query = Ticket.select(lambda t: t.user_id == str(user_id))
+    if since is not None:
+        query = query.filter(lambda t: t.date >= since)
+    return [ticket.to_dict(exclude='id') for ticket in query.order_by(Ticket.date)[:limit]]
+
+
+@db_session
+def last_ticket(user_id):
+    """
+    Функция получения последней брони пользователя
+
+    @param user_id: id пользователя
+    @return: словарь билета вместе с id или None
+    """
+    ticket = Ticket.select(lambda t: t.user_id == str(user_id)).order_by(desc(Ticket.id)).first()
+    return None if ticket is None else ticket.to_dict()
+
+
+@db_session
+def route_tickets(dep: str, dest: str, start: datetime.datetime, end: datetime.datetime):
+    """
+    Функция получения билетов на маршрут
+
+    @param start: начало периода вылетов включительно
+    @param end: конец периода не включительно
+    @return: список словарей билетов, отсортированный по дате вылета
+    """
+    query = Ticket.select(lambda t: t.departure_city == dep and t.destination_city == dest
+                          and t.date >= start and t.date < end)
+    return [ticket.to_dict(exclude='id') for ticket in query.order_by(Ticket.date)]
+
+
+@db_session
+def route_stats(dep: str, dest: str, start: datetime.date, end: datetime.date):
+    """
+    Функция получения статистики маршрута
+
+    @param start: первый день периода
+    @param end: последний день периода включительно
+    @return: словарь {день: (количество броней, количество билетов)}
+    """
+    query = select((s.day, s.bookings, s.tickets) for s in RouteDayStats
+                   if s.departure_city == dep and s.destination_city == dest and s.day >= start and s.day <= end)
+    return {day: (bookings, tickets) for day, bookings, tickets in query}
+
+
+@db_session
+def daily_totals(start: datetime.date, end: datetime.date):
+    """
+    Функция получения статистики по всем маршрутам
+
+    @return: словарь {день: (количество броней, количество билетов)}
+    """
+    query = select((s.day, pony_sum(s.bookings), pony_sum(s.tickets)) for s in RouteDayStats
+                   if s.day >= start and s.day <= end)
+    return {day: (bookings, tickets) for day, bookings, tickets in query}
+
+
+@db_session
+def top_routes(start: datetime.date, end: datetime.date, limit: int = 10):
+    """
+    Функция получения самых популярных маршрутов
+
+    @return: список (откуда, куда, количество билетов) по убыванию количества билетов
+    """
+    query = select((s.departure_city, s.destination_city, pony_sum(s.tickets)) for s in RouteDayStats
+                   if s.day >= start and s.day <= end)
+    return list(query.order_by(-3)[:limit])
+
@@ -1,12 +1,25 @@
 import datetime
-import requests
+import functools
+import itertools
+import json
+from collections import deque
+from contextlib import contextmanager
 import vk_api
-from pony.orm import db_session
+from pony.orm import db_session, flush, TransactionIntegrityError
 from vk_api.bot_longpoll import VkBotLongPoll
-import random
 import logging
+import time
+import uuid
+import bookings
+import bot_logging
+import delivery
 import handlers
-from models import UserState, Ticket
+import seats
+from callback_server import CallbackServer
+from models import UserState, init_db
+from sweeper import StateSweeper
+from ticket_cache import TicketCache
+from uploader import PhotoUploader
 
 try:
     import settings
@@ -15,57 +28,142 @@ except ImportError:
 
 log = logging.getLogger("bot")
 
+# Как часто (в событиях) писать в лог статистику удержания соединения с базой
+DB_REPORT_EVERY = 1000
 
-def create_log():
-    file_handler = logging.FileHandler(filename='logger.log', encoding='UTF8')
-    file_handler_formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s", datefmt='%d-%m-%Y %H:%M')
-    file_handler.setFormatter(file_handler_formatter)
-    file_handler.setLevel(logging.DEBUG)
+# Сколько раз обрабатывать событие заново, если состояние пользователя изменил другой обработчик
+STATE_RETRIES = 3
 
-    stream_handler = logging.StreamHandler()
-    stream_handler_formatter = logging.Formatter("%(levelname)s %(message)s")
-    stream_handler.setLevel(logging.INFO)
-    stream_handler.setFormatter(stream_handler_formatter)
+TIMEOUT_TEXT = 'Сценарий был прерван из-за долгого отсутствия ответа. Чтобы начать заново, используйте команду /ticket'
 
-    log.addHandler(file_handler)
-    log.addHandler(stream_handler)
 
-    log.setLevel(logging.DEBUG)
+def create_log(**config):
+    """
+    Подключает обработчики к логгеру бота, параметры см. в bot_logging.create_log и settings.LOG_CONFIG
+
+    @return: QueueListener, если включен режим очереди, иначе None
+    """
+    return bot_logging.create_log(log, **config)
 
 
 class Bot:
 
-    def __init__(self, token, group_id):
+    def __init__(self, token, group_id, long_poll=True):
+        """
+        @param long_poll: False - события приходят через Callback API (см. callback_server),
+        сервер Long Poll не запрашивается
+        """
         self.token = token
         self.group_id = group_id
 
         self.vk = vk_api.VkApi(token=token)
-        self.long_poller = VkBotLongPoll(self.vk, self.group_id)
+        self.long_poller = VkBotLongPoll(self.vk, self.group_id) if long_poll else None
 
         self.api = self.vk.get_api()
+        self.uploader = PhotoUploader(self.api, **getattr(settings, 'UPLOAD_CONFIG', {}))
+        self.ticket_cache = TicketCache(**getattr(settings, 'TICKET_CACHE', {}))
+        self.db_hold_times = deque(maxlen=1000)
+        self.processed_events = delivery.ProcessedEvents(**getattr(settings, 'EVENT_DEDUP', {}))
+        self.event_counter = itertools.count(1)
 
     def run(self):
         for event in self.long_poller.listen():
-            try:
-                self.on_event(event)
-            except Exception:
-                log.exception("event handling error")
+            self.process(event)
+
+    def process(self, event):
+        """
+        Обработка события с записью ошибок и времени обработки в лог, общая для Long Poll и Callback API
+        """
+        start = time.perf_counter()
+        try:
+            self.on_event(event)
+        except Exception:
+            log.exception("event handling error", extra={'peer_id': self.get_peer_id(event)})
+        log.debug('event handled', extra={'peer_id': self.get_peer_id(event),
+                                          'latency': round(time.perf_counter() - start, 4)})
+        if next(self.event_counter) % DB_REPORT_EVERY == 0:
+            log.info('db connection hold: %s', self.db_hold_report())
+
+    @staticmethod
+    def get_peer_id(event):
+        message = getattr(getattr(event, 'object', None), 'message', None)
+        return message.get('peer_id') if isinstance(message, dict) else None
 
-    @db_session
     def on_event(self, event):
+        """
+        Обработка события в четыре фазы:
+        загрузка состояния (короткая db_session) -> расчет без базы -> запись изменений (короткая db_session)
+        -> отправка сообщений и билетов. Соединение с базой не удерживается во время запросов к ВКонтакте.
+        Если за время расчета состояние пользователя изменил другой обработчик, событие обрабатывается заново
+        """
         if event.type != vk_api.bot_longpoll.VkBotEventType.MESSAGE_NEW:
             log.info('Unknown event %s', event.type)
             return
-        user_id = event.object.message['peer_id']
-        text = event.object.message['text']
+        # Повторно доставленное событие (после переподключения Long Poll или повтор запроса Callback API) пропускаем.
+        # Повтор, принятый другим процессом, отсеет claim в фазе записи
+        key = delivery.event_key(event)
+        if key is not None and self.processed_events.seen(key):
+            log.info('Duplicate event %s', key)
+            return
+
+        for _ in range(STATE_RETRIES):
+            ctx = EventContext(event.object.message['peer_id'], event.object.message['text'], key)
+            with self.db_phase(ctx):
+                state = UserState.get(user_id=str(ctx.user_id))
+                ctx.state = ctx.loaded_state = ScenarioState.load(state)
+
+            self.handle_message(ctx)
+
+            try:
+                with self.db_phase(ctx):
+                    self.commit(ctx)
+                break
+            except StaleState:
+                log.info('state changed by another handler, retrying event', extra={'peer_id': ctx.user_id})
+        else:
+            log.warning('state conflict, event %s dropped', key, extra={'peer_id': ctx.user_id})
+            return
+        if key is not None:
+            self.processed_events.add(key)
+
+        for action in ctx.outbox:
+            action()
+
+        self.db_hold_times.append(ctx.db_time)
+        log.debug('db connection hold', extra={'peer_id': ctx.user_id, 'latency': round(ctx.db_time, 4)})
 
-        state = UserState.get(user_id=str(user_id))
+    @contextmanager
+    def db_phase(self, ctx):
+        start = time.perf_counter()
+        with db_session:
+            yield
+        ctx.db_time += time.perf_counter() - start
+
+    def db_hold_report(self):
+        """
+        Статистика удержания соединения с базой за последние события
+
+        @return: словарь с количеством событий, средним, 95-м перцентилем и максимумом в секундах
+        """
+        times = sorted(self.db_hold_times)
+        if not times:
+            return {'events': 0}
+        return {'events': len(times),
+                'mean': sum(times) / len(times),
+                'p95': times[min(len(times) - 1, int(len(times) * 0.95))],
+                'max': times[-1]}
+
+    def handle_message(self, ctx):
+        text = ctx.text
         # Команда, позволяющая пользователю выйти с любой стадии сценария
         if text == '/exit':
-            if state is not None:
-                self.exit_from_state(user_id, state)
+            if ctx.state is not None:
+                self.exit_from_state(ctx)
             else:
-                self.send_message('На данный момент вы не находитесь ни в каком сценарии', user_id)
+                self.send_message('На данный момент вы не находитесь ни в каком сценарии', ctx)
+        elif text == '/resend':
+            # Повторная отправка последнего билета, сценарий не прерывается
+            ctx.outbox.append(functools.partial(self.resend_ticket, ctx.user_id, ctx.random_id()))
         else:
             # Ищем интенты
             for intent in settings.INTENTS:
@@ -73,95 +171,292 @@ class Bot:
                 if any(token in text.lower() for token in intent['tokens']):
                     # Если можно обойтись коротким ответом, отвечаем, не выходя их текущего сценария
                     if intent['answer']:
-                        self.send_message(intent['answer'], user_id)
+                        self.send_message(intent['answer'], ctx)
                     else:
                         # Иначе покидаем текущий сценарий
-                        if state is not None:
-                            self.exit_from_state(user_id, state)
+                        if ctx.state is not None:
+                            self.exit_from_state(ctx)
                         # Начинаем новый
-                        self.scenario_start(intent['scenario'], user_id, text)
+                        self.scenario_start(intent['scenario'], ctx)
                     break
             else:
                 # Если не находим интенты, продолжаем текущий сценарий, либо возвращем default answer
-                if state is not None:
-                    self.continue_scenario(user_id, text, state=state)
+                if ctx.state is not None:
+                    self.continue_scenario(ctx)
                 else:
-                    self.send_message(settings.DEFAULT_ANSWER, user_id)
+                    self.send_message(settings.DEFAULT_ANSWER, ctx)
 
-    def scenario_start(self, scenario_name, user_id, text):
+    def scenario_start(self, scenario_name, ctx):
         scenario = settings.SCENARIO[scenario_name]
         first_step = scenario['first_step']
         step = scenario['steps'][first_step]
-        user = self.api.users.get(user_ids=user_id)[0]
-        self.send_step(step, user_id, text, context={})
-        UserState(user_id=str(user_id), scenario_name=scenario_name, step_name=first_step,
-                  context=dict(can_continue=True, user_name=f"{user['first_name']} {user['last_name']}"))
+        user = self.api.users.get(user_ids=ctx.user_id)[0]
+        self.send_step(step, ctx, context={})
+        ctx.state = ScenarioState(scenario_name, first_step,
+                                  dict(can_continue=True, user_name=f"{user['first_name']} {user['last_name']}"))
 
-    def continue_scenario(self, user_id, text, state):
+    def continue_scenario(self, ctx):
+        state = ctx.state
         step = settings.SCENARIO[state.scenario_name]['steps'][state.step_name]
+        log.debug('continue scenario', extra={'peer_id': ctx.user_id, 'step': state.step_name})
 
         handler = getattr(handlers, step['handler'])
-        if handler(string=text, context=state.context):
+        if handler(string=ctx.text, context=state.context):
             # Проверяю небоходим ли рестарт сценария
             if 'restart' in state.context:
                 # Если да, запускаю сценарий заново
                 if state.context['restart'] is not None:
-                    self.scenario_start(state.context['restart'], user_id, text)
+                    self.scenario_start(state.context['restart'], ctx)
                 # Если пользователь отказался, покидаю сценарий
                 else:
-                    self.exit_from_state(user_id, state)
+                    self.exit_from_state(ctx)
             # Рестарт не нужен
             else:
                 # Определяю следующий шаг
                 next_step_name = step['next_step'] if state.context['can_continue'] else 'restart'
                 next_step = settings.SCENARIO[state.scenario_name]['steps'][next_step_name]
 
-                self.send_step(next_step, user_id, text, state.context)
+                self.send_step(next_step, ctx, state.context)
                 # проверяю can_continue чтобы сработал шаг 'return'
                 if next_step['next_step'] or not state.context['can_continue']:
                     state.step_name = next_step_name
                 else:
-                    Ticket(user_id=str(user_id),
-                           departure_city=state.context['departure_city'],
-                           destination_city=state.context['destination_city'],
-                           date=datetime.datetime.strptime(state.context['date'], '%d-%m-%Y %H:%M'),
-                           ticket_count=state.context['ticket_count'],
-                           commentary=state.context['commentary'])
-                    state.delete()
+                    # Места бронируются и билет записывается в фазе commit, до отправки билета
+                    ctx.booking = state.context
+                    ctx.state = None
         else:
-            self.send_message(step['failure_text'].format(**state.context), user_id)
+            # Хэндлер может указать причину ошибки, для которой у шага есть отдельный текст
+            reason = state.context.pop('failure', None)
+            failure_text = step.get('failure_texts', {}).get(reason, step['failure_text'])
+            self.send_message(failure_text.format(**state.context), ctx)
+
+    def commit(self, ctx):
+        """
+        Запись результата обработки события в базу: состояние сценария, места и билет.
+        Строка состояния блокируется и сверяется по версии с загруженной, при расхождении выбрасывается StaleState
+        """
+        row = UserState.get_for_update(user_id=str(ctx.user_id))
+        loaded = ctx.loaded_state
+        if row is not None and (loaded is None or row.version != loaded.version):
+            raise StaleState(ctx.user_id)
+        if ctx.delivery_key is not None and not self.processed_events.claim(ctx.delivery_key):
+            # Событие обработал другой процесс, пока шел расчет
+            log.info('Duplicate event %s', ctx.delivery_key)
+            ctx.outbox.clear()
+            return
+
+        if row is None and loaded is not None and (ctx.booking is not None or ctx.state is loaded):
+            # Сборщик удалил состояние между загрузкой и записью и уже мог уведомить о прерывании сценария.
+            # Шаг устаревшего сценария не записывается: строка не создается заново, бронь не делается.
+            # Новый сценарий, начатый этим событием, записывается как обычно
+            ctx.booking, ctx.state = None, None
+            ctx.outbox.clear()
+            self.send_message(TIMEOUT_TEXT, ctx)
+            return
+
+        if ctx.booking is not None:
+            try:
+                self.book(ctx.user_id, ctx.booking)
+            except seats.NotEnoughSeats:
+                # Сообщения последнего шага еще не отправлены, заменяю их сообщением об ошибке
+                ctx.outbox.clear()
+                self.send_message('К сожалению, на этом рейсе не осталось столько свободных мест. '
+                                  'Попробуйте выбрать другой рейс', ctx)
+
+        if ctx.state is None:
+            if row is not None:
+                row.delete()
+        elif row is None:
+            UserState(user_id=str(ctx.user_id), scenario_name=ctx.state.scenario_name,
+                      step_name=ctx.state.step_name, context=ctx.state.context)
+            try:
+                flush()
+            except TransactionIntegrityError:
+                # Строку одновременно создал другой обработчик
+                raise StaleState(ctx.user_id)
+        else:
+            row.scenario_name, row.step_name, row.context = \
+                ctx.state.scenario_name, ctx.state.step_name, ctx.state.context
+            row.last_activity = datetime.datetime.now()
+            row.version += 1
+
+    def book(self, user_id, context):
+        # Для маршрута с пересадками места бронируются на каждом перелете
+        legs = context.get('legs') or [(context['departure_city'], context['destination_city'], context['date'])]
+        legs = [(dep, dest, datetime.datetime.strptime(date, '%d-%m-%Y %H:%M')) for dep, dest, date in legs]
+        # Билет рендерится после commit из этого же словаря, поэтому места попадут на него
+        context['seats'] = seats.allocate_legs(legs, int(context['ticket_count']))[0]
 
-    def exit_from_state(self, user_id, state):
-        self.send_message('Вы успешно вышли из сценария', user_id)
-        state.delete()
+        ticket = bookings.add_ticket(user_id,
+                                     departure_city=context['departure_city'],
+                                     destination_city=context['destination_city'],
+                                     date=datetime.datetime.strptime(context['date'], '%d-%m-%Y %H:%M'),
+                                     ticket_count=int(context['ticket_count']),
+                                     commentary=context['commentary'],
+                                     seats=context['seats'])
+        # id брони - ключ билета в кэше, по нему билет можно отправить повторно
+        ticket.flush()
+        context['ticket_id'] = ticket.id
 
-    def send_message(self, text_to_send, user_id):
+    def exit_from_state(self, ctx):
+        self.send_message('Вы успешно вышли из сценария', ctx)
+        ctx.state = None
+
+    def send_message(self, text_to_send, ctx):
+        # Отправка откладывается до записи изменений в базу
+        ctx.outbox.append(functools.partial(self.api_send_message, text_to_send, ctx.user_id, ctx.random_id()))
+
+    def api_send_message(self, text_to_send, user_id, random_id=None):
         self.api.messages.send(message=text_to_send,
-                               random_id=random.randint(0, 2 ** 20),
+                               random_id=random_id or delivery.make_random_id(user_id),
                                peer_id=user_id)
 
-    def send_image(self, image, user_id):
-        upload_url = self.api.photos.getMessagesUploadServer()['upload_url']
-        upload_data = requests.post(url=upload_url, files={'photo': ('image.png', image, 'image/png')}).json()
-        image_data = self.api.photos.saveMessagesPhoto(**upload_data)
-        attachment = f"photo{image_data[0]['owner_id']}_{image_data[0]['id']}"
+    def resend_ticket(self, user_id, random_id=None):
+        """
+        Повторная отправка билета последней брони пользователя (команда /resend, также для поддержки).
+        Билет берется из кэша по id брони, а если запись вытеснена, рендерится заново по данным Ticket
+
+        @param user_id: id пользователя
+        @param random_id: random_id сообщения
+        """
+        ticket = bookings.last_ticket(user_id)
+        if ticket is None:
+            self.api_send_message('У вас пока нет забронированных билетов', user_id, random_id)
+            return
+
+        def render():
+            user = self.api.users.get(user_ids=user_id)[0]
+            context = dict(ticket, user_name=f"{user['first_name']} {user['last_name']}",
+                           date=ticket['date'].strftime('%d-%m-%Y %H:%M'))
+            return handlers.generate_image('', context)
+
+        self.send_image(render, user_id, cache_key=TicketCache.key(ticket['id']), random_id=random_id)
+
+    def notify_timeout(self, user_id):
+        self.api_send_message(TIMEOUT_TEXT, user_id)
+
+    def send_image(self, image, user_id, cache_key=None, random_id=None):
+        """
+        Отправляет билет пользователю
+
+        @param image: изображение, список изображений или функция, которая их создает
+        @param user_id: id пользователя
+        @param cache_key: ключ брони в кэше, если билет уже загружался, он не рендерится и не загружается снова
+        @param random_id: random_id сообщения, по умолчанию случайный
+        """
+        attachment = self.ticket_cache.get_attachment(cache_key) if cache_key else None
+        if attachment is not None:
+            try:
+                self.api.messages.send(attachment=attachment,
+                                       random_id=random_id or delivery.make_random_id(user_id),
+                                       peer_id=user_id)
+                return
+            except vk_api.ApiError:
+                # Вложение больше не принимается (например, фото удалено), загружаю билет заново
+                log.warning('cached attachment %s rejected', attachment, extra={'peer_id': user_id})
+
+        # Сохраненное изображение загружается без повторного рендера
+        stored = self.ticket_cache.get_image(cache_key) if cache_key else None
+        if stored is not None:
+            image = stored
+        elif callable(image):
+            image = image()
+        # Несколько билетов загружаются параллельно и отправляются одним сообщением
+        if isinstance(image, list):
+            attachment = ','.join(self.uploader.upload_many(image))
+            image = None
+        else:
+            attachment = self.uploader.upload(image)
+        if cache_key:
+            self.ticket_cache.put(cache_key, image, attachment)
 
         self.api.messages.send(attachment=attachment,
-                               random_id=random.randint(0, 2 ** 20),
+                               random_id=random_id or delivery.make_random_id(user_id),
                                peer_id=user_id)
 
-    def send_step(self, step, user_id, text, context):
+    def send_step(self, step, ctx, context):
         if 'text' in step:
-            self.send_message(step['text'].format(**context), user_id)
+            self.send_message(step['text'].format(**context), ctx)
         if 'image' in step:
             handler = getattr(handlers, step['image'])
-            image = handler(text, context)
-            self.send_image(image, user_id)
+            random_id = ctx.random_id()
+
+            def send_ticket():
+                # Ключ считается при отправке: id брони появляется в контексте в фазе commit
+                self.send_image(functools.partial(handler, ctx.text, context), ctx.user_id,
+                                cache_key=TicketCache.key(context.get('ticket_id')), random_id=random_id)
+
+            ctx.outbox.append(send_ticket)
+
+
+class StaleState(Exception):
+    """
+    Состояние пользователя изменилось между загрузкой и записью
+    """
+
+
+class ScenarioState:
+    """
+    Копия UserState, с которой работает фаза расчета без открытой db_session
+    """
+
+    def __init__(self, scenario_name, step_name, context, version=None):
+        self.scenario_name, self.step_name, self.context = scenario_name, step_name, context
+        # Версия загруженной строки UserState, None - состояние начато этим событием
+        self.version = version
+
+    @classmethod
+    def load(cls, state):
+        if state is None:
+            return None
+        # Json из Pony отслеживает изменения, поэтому отвязываю контекст от строки
+        return cls(state.scenario_name, state.step_name, json.loads(json.dumps(state.context)), state.version)
+
+
+class EventContext:
+    """
+    Данные обработки одного события: состояние сценария, бронь для записи и отложенные отправки
+    """
+
+    def __init__(self, user_id, text, event_key=None):
+        self.user_id, self.text = user_id, text
+        # Без идентификатора события random_id все равно не должны пересекаться между сообщениями
+        self.event_key = event_key or uuid.uuid4().hex
+        # Идентификатор для журнала обработанных событий, None - у события нет устойчивого идентификатора
+        self.delivery_key = event_key
+        self.state, self.booking = None, None
+        # Состояние, загруженное из UserState, None - если строки не было
+        self.loaded_state = None
+        self.outbox = []
+        self.messages = 0
+        self.db_time = 0.0
+
+    def random_id(self):
+        """
+        random_id очередного сообщения ответа: одинаковый при повторной обработке того же события
+        """
+        self.messages += 1
+        return delivery.make_random_id(self.user_id, self.event_key, self.messages)
 
 
 if __name__ == "__main__":
-    create_log()
-    bot = Bot(settings.TOKEN, settings.GROUP_ID)
-    bot.run()
+    listener = create_log(**getattr(settings, 'LOG_CONFIG', {}))
+    init_db(settings.DB_CONFIG)
+    callback_config = getattr(settings, 'CALLBACK_SERVER', None)
+    bot = Bot(settings.TOKEN, settings.GROUP_ID, long_poll=not callback_config)
+    sweeper_config = dict(getattr(settings, 'SESSION_SWEEPER', {}))
+    notify = sweeper_config.pop('notify', False)
+    sweeper = StateSweeper(notify=bot.notify_timeout if notify else None, cleanup=bot.processed_events.cleanup,
+                           **sweeper_config)
+    sweeper.start()
+    try:
+        if callback_config:
+            CallbackServer(bot, **callback_config).run()
+        else:
+            bot.run()
+    finally:
+        sweeper.stop()
+        if listener is not None:
+            listener.stop()
 
 
@@ -0,0 +1,141 @@
+"""
+Модуль настройки логирования бота
+
+    JsonFormatter - форматирование записей лога в JSON с полями peer_id, step и latency
+    RateLimitFilter - ограничение частоты повторяющихся сообщений (например 'Unknown event')
+    ExceptionQueueHandler - QueueHandler, сохраняющий traceback отдельно от текста сообщения
+    create_log - подключение обработчиков к логгеру, синхронно или через очередь
+"""
+
+import copy
+import json
+import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+FILE_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+STREAM_FORMAT = "%(levelname)s %(message)s"
+DATEFMT = '%d-%m-%Y %H:%M'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Форматтер, записывающий каждую запись лога одной JSON-строкой.
+    Дополнительные поля передаются через extra: log.info('...', extra={'peer_id': 1, 'step': 'step1'})
+    """
+
+    FIELDS = ('peer_id', 'step', 'latency')
+
+    def format(self, record):
+        data = {'time': self.formatTime(record, self.datefmt),
+                'level': record.levelname,
+                'message': record.getMessage()}
+        for field in self.FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+
+        return json.dumps(data, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Фильтр, пропускающий не более rate одинаковых сообщений за period секунд.
+    Сообщения сравниваются по шаблону и аргументам, ограничиваются только шаблоны, начинающиеся с prefixes.
+    Когда окно заканчивается, первая пропущенная запись сообщает, сколько повторов было отброшено.
+    """
+
+    def __init__(self, prefixes=('Unknown event',), rate=5, period=60.0, max_keys=1000):
+        super().__init__()
+        self.prefixes = tuple(prefixes)
+        self.rate, self.period, self.max_keys = rate, period, max_keys
+        # ключ -> [начало окна, количество пропущенных, количество отброшенных]
+        self.windows = {}
+
+    def filter(self, record):
+        if not isinstance(record.msg, str) or not record.msg.startswith(self.prefixes):
+            return True
+
+        key = (record.msg, str(record.args))
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or now - window[0] >= self.period:
+            if window is not None and window[2]:
+                record.msg = f'{record.msg} (повторов отброшено: {window[2]})'
+            if window is None and len(self.windows) >= self.max_keys:
+                self.windows.clear()
+            self.windows[key] = [now, 1, 0]
+            return True
+
+        if window[1] < self.rate:
+            window[1] += 1
+            return True
+
+        window[2] += 1
+        return False
+
+
+class ExceptionQueueHandler(QueueHandler):
+    """
+    Стандартный QueueHandler.prepare дописывает traceback в текст сообщения и очищает exc_info и exc_text,
+    поэтому JsonFormatter в потоке listener'а не может вынести его в поле exception.
+    Здесь traceback форматируется заранее и передается в exc_text, а сообщение остается без него
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # Сам traceback не передается в очередь, чтобы не удерживать кадры стека
+        record.exc_info = None
+        return record
+
+
+def create_log(logger, filename='logger.log', queued=False, structured=False, rate_limit=None):
+    """
+    Функция подключения обработчиков к логгеру
+
+    @param logger: логгер, к которому подключаются обработчики
+    @param filename: файл для записи лога
+    @param queued: если True, запись в файл и консоль выполняется в отдельном потоке через QueueListener
+    @param structured: если True, в файл пишутся JSON-записи
+    @param rate_limit: словарь параметров RateLimitFilter, None - без ограничения
+    @return: запущенный QueueListener (его нужно остановить при завершении) или None
+    """
+    file_handler = logging.FileHandler(filename=filename, encoding='UTF8')
+    if structured:
+        file_handler.setFormatter(JsonFormatter(datefmt=DATEFMT))
+    else:
+        file_handler.setFormatter(logging.Formatter(FILE_FORMAT, datefmt=DATEFMT))
+    file_handler.setLevel(logging.DEBUG)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(logging.Formatter(STREAM_FORMAT))
+
+    logger.setLevel(logging.DEBUG)
+
+    if not queued:
+        handlers = [file_handler, stream_handler]
+        listener = None
+    else:
+        # Поток событий только кладет запись в очередь, форматирование и I/O выполняются в потоке listener'а
+        log_queue = queue.SimpleQueue()
+        handlers = [ExceptionQueueHandler(log_queue)]
+        listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+        listener.start()
+
+    # Фильтр стоит на самом логгере, до очереди, чтобы поток одинаковых событий не заполнял её
+    if rate_limit is not None:
+        logger.addFilter(RateLimitFilter(**rate_limit))
+    for handler in handlers:
+        logger.addHandler(handler)
+
+    return listener
@@ -0,0 +1,64 @@
+"""
+Локальный клиент Callback API: отправляет записанные события на сервер бота так же, как это делает ВКонтакте
+
+Запуск из корня проекта:
+    python callback_client.py http://localhost:8080/callback [файл событий] [--secret КЛЮЧ]
+По умолчанию используется files/recorded_events.json
+"""
+
+import argparse
+import json
+from pathlib import Path
+
+import requests
+
+BASEDIR = Path(__file__).resolve().parent
+RECORDED_EVENTS = BASEDIR / 'files/recorded_events.json'
+
+
+def load_events(filename=RECORDED_EVENTS):
+    """
+    Функция загрузки записанных событий
+
+    @param filename: JSON файл со списком тел запросов Callback API
+    @return: список событий
+    """
+    with open(filename, mode='r', encoding='utf8') as ff:
+        return json.load(ff)
+
+
+def post_events(url, events, secret=None, session=None, timeout=5):
+    """
+    Функция отправки событий по одному, в порядке записи
+
+    @param url: адрес сервера Callback API
+    @param events: список событий
+    @param secret: секретный ключ, добавляется в каждое событие
+    @param session: requests.Session, по умолчанию создается новая
+    @param timeout: таймаут запроса в секундах
+    @return: список пар (код ответа, текст ответа)
+    """
+    session = session or requests.Session()
+    responses = []
+    for event in events:
+        if secret is not None:
+            event = dict(event, secret=secret)
+        response = session.post(url, json=event, timeout=timeout)
+        responses.append((response.status_code, response.text))
+    return responses
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('url')
+    parser.add_argument('events', nargs='?', default=RECORDED_EVENTS)
+    parser.add_argument('--secret')
+    args = parser.parse_args()
+
+    events = load_events(args.events)
+    for event, (status, text) in zip(events, post_events(args.url, events, args.secret)):
+        print(f"{event['type']:<20} {event.get('event_id', ''):<12} {status} {text}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""
+Модуль приема событий через Callback API ВКонтакте
+
+    parse_event - создание VkBotEvent из JSON запроса, как это делает VkBotLongPoll
+    EventWorker - поток, обрабатывающий события своей очереди через Bot.process
+    CallbackServer - HTTP сервер (aiohttp): подтверждение адреса, проверка секретного ключа, постановка в очередь
+
+Сервер отвечает "ok" сразу после постановки события в очередь, обработка идет в потоках EventWorker.
+События одного peer_id всегда попадают в один поток, поэтому сообщения пользователя обрабатываются по порядку.
+Состояние сценариев и журнал обработанных событий хранятся в базе, а не в сервере, поэтому несколько
+процессов бота можно поставить за балансировщик. Если ВКонтакте повторит запрос, не дождавшись ответа,
+дубль отсеет Bot.processed_events, даже если его принял другой процесс. Если два процесса одновременно
+обрабатывают сообщения одного пользователя, Bot.commit заметит это по версии UserState, и событие
+обработается заново по новому состоянию.
+aiohttp импортируется только при запуске сервера, в режиме Long Poll он не нужен.
+"""
+
+import logging
+import queue
+import threading
+
+from vk_api.bot_longpoll import VkBotLongPoll
+
+log = logging.getLogger("bot")
+
+
+def parse_event(raw: dict):
+    """
+    Функция создания события
+
+    @param raw: тело запроса Callback API
+    @return: VkBotMessageEvent для событий сообщений, VkBotEvent для остальных
+    """
+    event_class = VkBotLongPoll.CLASS_BY_EVENT_TYPE.get(raw['type'], VkBotLongPoll.DEFAULT_EVENT_CLASS)
+    return event_class(raw)
+
+
+class EventWorker(threading.Thread):
+    """
+    Класс потока обработки событий
+    """
+
+    def __init__(self, bot, queue_size=1000):
+        super().__init__(daemon=True)
+        self.bot = bot
+        self.queue = queue.Queue(maxsize=queue_size)
+
+    def run(self):
+        while True:
+            event = self.queue.get()
+            try:
+                if event is None:
+                    return
+                self.bot.process(event)
+            finally:
+                self.queue.task_done()
+
+    def stop(self):
+        # Событие-пустышка ставится в конец очереди, поэтому уже принятые события будут обработаны
+        self.queue.put(None)
+
+
+class CallbackServer:
+    """
+    Класс сервера Callback API
+    """
+
+    def __init__(self, bot, confirmation, secret=None, host='0.0.0.0', port=8080, path='/callback', workers=4,
+                 queue_size=1000):
+        """
+        @param bot: Bot, созданный с long_poll=False
+        @param confirmation: строка, которую должен вернуть сервер для подтверждения адреса
+        @param secret: секретный ключ из настроек Callback API, None - не проверяется
+        @param host: адрес сервера
+        @param port: порт сервера
+        @param path: путь, на который ВКонтакте отправляет события
+        @param workers: количество потоков обработки
+        @param queue_size: размер очереди каждого потока, при переполнении сервер отвечает 503,
+        и ВКонтакте повторит запрос
+        """
+        self.bot = bot
+        self.confirmation, self.secret = confirmation, secret
+        self.host, self.port, self.path = host, port, path
+        self.workers = [EventWorker(bot, queue_size) for _ in range(workers)]
+
+    def start_workers(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+        for worker in self.workers:
+            worker.join()
+
+    def join(self):
+        """
+        Ожидание обработки всех принятых событий
+        """
+        for worker in self.workers:
+            worker.queue.join()
+
+    def dispatch(self, raw: dict):
+        """
+        Функция постановки события в очередь
+
+        @param raw: тело запроса Callback API
+        @return: False, если очередь потока переполнена
+        """
+        event = parse_event(raw)
+        peer_id = self.bot.get_peer_id(event)
+        worker = self.workers[hash(peer_id) % len(self.workers)]
+        try:
+            worker.queue.put_nowait(event)
+        except queue.Full:
+            log.warning('callback queue is full, event %s rejected', raw.get('event_id'))
+            return False
+        return True
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        try:
+            raw = await request.json()
+        except ValueError:
+            return web.Response(status=400, text='bad request')
+        if not isinstance(raw, dict):
+            return web.Response(status=400, text='bad request')
+
+        if raw.get('type') == 'confirmation':
+            return web.Response(text=self.confirmation)
+        if self.secret is not None and raw.get('secret') != self.secret:
+            log.warning('callback request with wrong secret from %s', request.remote)
+            return web.Response(status=403, text='forbidden')
+        if 'type' not in raw:
+            return web.Response(status=400, text='bad request')
+
+        if not self.dispatch(raw):
+            return web.Response(status=503, text='busy')
+        return web.Response(text='ok')
+
+    def make_app(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    def run(self):
+        from aiohttp import web
+
+        self.start_workers()
+        try:
+            web.run_app(self.make_app(), host=self.host, port=self.port, print=None)
+        finally:
+            self.stop_workers()
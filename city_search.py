@@ -0,0 +1,144 @@
+"""
+Модуль нечеткого поиска городов
+
+    CitySearch - индекс по символьным триграммам названий городов
+    levenshtein - расстояние Левенштейна с ограничением сверху
+"""
+
+import re
+from collections import Counter
+
+re_word = re.compile(r'\w+')
+
+
+def normalize(word):
+    return word.lower().replace('ё', 'е')
+
+
+def trigrams(word):
+    """
+    Функция разбиения слова на триграммы
+
+    @param word: нормализованное слово
+    @return: список триграмм слова, дополненного '$' с обеих сторон
+    """
+    padded = f'${word}$'
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def levenshtein(first, second, bound):
+    """
+    Функция вычисления расстояния Левенштейна с ограничением
+
+    @param first: первое слово
+    @param second: второе слово
+    @param bound: максимальное интересующее расстояние
+    @return: расстояние, либо bound + 1, если оно больше bound
+    """
+    if abs(len(first) - len(second)) > bound:
+        return bound + 1
+
+    previous = list(range(len(second) + 1))
+    for i, char in enumerate(first, 1):
+        current = [i]
+        for j, other in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        # Если вся строка больше ограничения, дальше расстояние может только расти
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+
+    return min(previous[-1], bound + 1)
+
+
+class CitySearch:
+    """
+    Класс поиска города по слову с опечатками.
+    Индекс строится один раз: для каждой триграммы хранится список городов, в которых она встречается.
+    При поиске кандидаты отбираются по количеству общих триграмм, и только для них считается
+    расстояние Левенштейна с ограничением.
+    """
+
+    def __init__(self, cities):
+        self.cities = sorted(set(cities))
+        self.names = [normalize(city) for city in self.cities]
+        self.index = {}
+        for city_id, name in enumerate(self.names):
+            for gram in set(trigrams(name)):
+                self.index.setdefault(gram, []).append(city_id)
+
+    @staticmethod
+    def max_distance(word):
+        return 1 if len(word) <= 5 else 2
+
+    def candidates(self, word):
+        """
+        Функция отбора кандидатов
+
+        @param word: нормализованное слово
+        @return: Counter {id города: количество общих триграмм}
+        """
+        shared = Counter()
+        for gram in set(trigrams(word)):
+            shared.update(self.index.get(gram, ()))
+        return shared
+
+    def match(self, word):
+        """
+        Функция поиска города, совпадающего со словом с точностью до опечаток
+
+        @param word: слово из сообщения пользователя
+        @return: название города или None
+        """
+        word = normalize(word)
+        if len(word) < 4:
+            return None
+
+        bound = self.max_distance(word)
+        # Каждая правка затрагивает не более 3 триграмм, поэтому кандидаты с меньшим числом общих триграмм
+        # гарантированно дальше bound
+        need = len(trigrams(word)) - 3 * bound
+        best, best_distance = None, bound + 1
+        for city_id, count in self.candidates(word).items():
+            if count < need:
+                continue
+            distance = levenshtein(word, self.names[city_id], best_distance - 1)
+            if distance < best_distance:
+                best, best_distance = city_id, distance
+                if distance == 0:
+                    break
+
+        return self.cities[best] if best is not None else None
+
+    def search(self, string):
+        """
+        Функция поиска города в сообщении
+
+        @param string: сообщение пользователя
+        @return: название первого найденного города или None
+        """
+        for word in re_word.findall(string):
+            city = self.match(word)
+            if city is not None:
+                return city
+        return None
+
+    def suggest(self, string, k=5):
+        """
+        Функция подбора похожих городов для сообщения об ошибке
+
+        @param string: сообщение пользователя
+        @param k: количество подсказок
+        @return: до k городов, отсортированных по похожести
+        """
+        scores = {}
+        for word in re_word.findall(normalize(string)):
+            bound = max(len(word) // 2, 1)
+            # Расстояние считаем только для городов с наибольшим количеством общих триграмм
+            for city_id, count in self.candidates(word).most_common(k * 3):
+                distance = levenshtein(word, self.names[city_id], bound)
+                score = (distance, -count)
+                if distance <= bound and score < scores.get(city_id, (bound + 1, 0)):
+                    scores[city_id] = score
+
+        return [self.cities[city_id] for city_id in sorted(scores, key=scores.get)[:k]]
@@ -0,0 +1,116 @@
+"""
+Модуль идемпотентной доставки
+
+    event_key - устойчивый идентификатор события ВКонтакте
+    make_random_id - random_id для messages.send, детерминированный по (peer_id, событие, номер сообщения)
+    ProcessedEvents - кэш обработанных событий в памяти и их журнал в базе, общий для всех процессов бота
+"""
+
+import datetime
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from pony.orm import db_session
+
+from models import ProcessedEvent, insert_missing
+
+
+def event_key(event):
+    """
+    Функция получения идентификатора события
+
+    @param event: событие VkBotEvent
+    @return: event_id из Callback/Long Poll API, либо peer_id:conversation_message_id, либо None
+    """
+    raw = getattr(event, 'raw', None) or {}
+    if raw.get('event_id'):
+        return str(raw['event_id'])
+
+    message = getattr(getattr(event, 'object', None), 'message', None) or {}
+    if message.get('conversation_message_id'):
+        return f"{message.get('peer_id')}:{message['conversation_message_id']}"
+    return None
+
+
+def make_random_id(peer_id, key=None, index=0):
+    """
+    Функция вычисления random_id.
+    При повторной обработке того же события получаются те же random_id, и ВКонтакте не отправит дубль,
+    а разные события и сообщения не пересекаются, в отличие от random.randint(0, 2 ** 20)
+
+    @param peer_id: получатель
+    @param key: идентификатор события, None - случайный
+    @param index: номер сообщения в ответе на событие
+    @return: положительное 31-битное число
+    """
+    key = key or uuid.uuid4().hex
+    digest = hashlib.blake2b(f'{peer_id}:{key}:{index}'.encode('utf8'), digest_size=4).digest()
+    return int.from_bytes(digest, 'big') & 0x7FFFFFFF or 1
+
+
+class ProcessedEvents:
+    """
+    Класс защиты от повторной обработки событий.
+    Повторы, уже обработанные этим процессом, отсекает кэш в памяти: OrderedDict хранит ключи в порядке добавления,
+    поэтому проверка и вытеснение самых старых выполняются за O(1) и без запросов к базе.
+    Общая таблица models.ProcessedEvent с уникальным ключом нужна только для claim: она не дает двум процессам
+    записать результат одного события
+    """
+
+    def __init__(self, size=10000, ttl=600):
+        self.size, self.ttl = size, ttl
+        self.events = OrderedDict()
+        self.lock = threading.Lock()
+
+    def seen(self, key):
+        """
+        Функция проверки события в кэше процесса
+
+        @param key: идентификатор события
+        @return: True - если событие уже обрабатывалось этим процессом в течение ttl
+        """
+        now = time.monotonic()
+        with self.lock:
+            # Удаляю устаревшие события с начала очереди
+            while self.events:
+                oldest, added = next(iter(self.events.items()))
+                if now - added < self.ttl:
+                    break
+                del self.events[oldest]
+
+            return key in self.events
+
+    def add(self, key):
+        """
+        Функция регистрации события в кэше процесса. Вызывается после записи результата обработки,
+        чтобы событие, обработку которого пришлось повторить, не считалось дублем
+
+        @param key: идентификатор события
+        """
+        with self.lock:
+            self.events[key] = time.monotonic()
+            self.events.move_to_end(key)
+            if len(self.events) > self.size:
+                self.events.popitem(last=False)
+
+    def claim(self, key):
+        """
+        Функция регистрации события в общей таблице. Вызывается внутри db_session, в которой записывается
+        результат обработки, поэтому при ее откате событие не считается обработанным
+
+        @param key: идентификатор события
+        @return: True - если событие записано этой транзакцией, False - если его уже обработал другой процесс
+        """
+        return insert_missing(ProcessedEvent, event_key=key, created=datetime.datetime.now())
+
+    @db_session
+    def cleanup(self):
+        """
+        Функция удаления из общей таблицы событий старше ttl. Вызывается из StateSweeper,
+        а не при обработке событий, чтобы не удлинять их транзакции
+        """
+        border = datetime.datetime.now() - datetime.timedelta(seconds=self.ttl)
+        ProcessedEvent.select(lambda event: event.created < border).delete(bulk=True)
@@ -17,9 +17,11 @@ import datetime
 from pathlib import Path
 
 import Timetable as tt
-from ticket_create import TicketCreator
+import journey
+import seats
 
 re_count = re.compile(r'\b[1-5]\b')
+re_number = re.compile(r'\b\d+\b')
 re_date = re.compile(r'\b(?:0?[1-9]|[12][0-9]|3[01])-(?:0?[1-9]|1[0-2])-([0-2][0-9][0-9][0-9])\b')
 re_phone = re.compile(r'\b\+?[78][-(]?\d{3}\)?-?\d{3}-?\d{2}-?\d{2}\b')
 
@@ -71,14 +73,60 @@ def date(string, context):
         date = datetime.datetime.strptime(departure_date[0], tt.DATE)
         if date.date() >= datetime.datetime.now().date():
             context['departure_date'] = departure_date[0]
-            context['suitable_flights'] = tt.get_date(context['departure_city'], context['destination_city'],
-                                                      departure_date[0])
-            context['flights_to_print'] = tt.dict_formatter(context['suitable_flights'])
+            if context['destination_city'] in tt.get_destination(context['departure_city']):
+                route = (context['departure_city'], context['destination_city'])
+                # Полностью занятые рейсы не предлагаем
+                nearest = tt.get_date(*route, departure_date[0], min_seats=1)
+                # Рейсы в соседние дни показываются календарем с нумерацией, продолжающей список ближайших,
+                # чтобы их можно было выбрать тем же шагом
+                window = tt.get_date_window([route], departure_date[0], tt.WINDOW_DAYS)
+                departures = [datetime.datetime.strptime(flight, tt.DATETIME) for flight in tt.window_flights(window)]
+                free = {departure.strftime(tt.DATETIME) for departure in seats.filter_available(*route, departures)}
+                # Занятые рейсы и рейсы, уже попавшие в список ближайших, из календаря убираются
+                free -= set(nearest)
+                nearby = {}
+                for day, flights in window.items():
+                    times = [time for time in flights[route] if f'{day} {time}' in free]
+                    if times:
+                        nearby[day] = {route: times}
+
+                context['suitable_flights'] = nearest + tt.window_flights(nearby)
+                context['flights_to_print'] = tt.dict_formatter(nearest)
+                context.pop('connections', None)
+                if nearby:
+                    context['flights_to_print'] += '\n\nРейсы в соседние дни:\n'
+                    context['flights_to_print'] += tt.calendar_formatter(nearby, len(nearest) + 1)
+            else:
+                # Прямого рейса нет, предлагаем маршруты с пересадками, на всех перелетах которых есть места
+                itineraries = [itinerary for itinerary in
+                               journey.get_planner().plan(context['departure_city'], context['destination_city'],
+                                                          date, count=tt.SUGGESTIONS * 2)
+                               if has_seats(itinerary)][:tt.SUGGESTIONS]
+                if not itineraries:
+                    context['failure'] = 'no_route'
+                    return False
+                context['suitable_flights'] = [itinerary[0][2].strftime(tt.DATETIME) for itinerary in itineraries]
+                context['connections'] = [[[dep, dest, departure.strftime(tt.DATETIME)]
+                                           for dep, dest, departure, arrival in itinerary]
+                                          for itinerary in itineraries]
+                context['flights_to_print'] = tt.dict_formatter(journey.itinerary_formatter(itinerary)
+                                                                for itinerary in itineraries)
             return True
 
     return False
 
 
+def has_seats(itinerary, count=1):
+    """
+    Функция проверки свободных мест на всех перелетах маршрута
+
+    @param itinerary: список перелетов [(откуда, куда, вылет, прибытие)]
+    @param count: необходимое количество мест
+    @return: True - если на каждом перелете есть count свободных мест
+    """
+    return all(seats.filter_available(dep, dest, [departure], count) for dep, dest, departure, arrival in itinerary)
+
+
 def confirmation(string, context):
     """
     Хэндлер проверки правильности ответа пользователя на сообщение о подтверждении данных
@@ -99,16 +147,16 @@ def departure_city(string, context):
 
     @param string: сообщение пользователя
     @param context: словарь для хранения полученной информации
-    @return: True - если в сообщении присутствует город отправления в доступных формах
+    @return: True - если в сообщении присутствует город отправления в доступных формах или с опечаткой
     """
     cities = tt.get_departure_city()
-    context['departure'] = list(set(cities))
-    for city, reformat in tt.reformat_city(cities):
-        departure_city = re.search(r'\b{}'.format(reformat.lower()), string.lower())
-        if departure_city:
-            context['departure_city'] = city
-            context['destination'] = list(tt.get_destination(city))
-            return True
+    city = find_city(string, cities)
+    if city is not None:
+        context['departure_city'] = city
+        context['destination'] = list(tt.get_destination(city))
+        return True
+
+    context['departure'] = suggest_cities(string, cities)
     return False
 
 
@@ -118,17 +166,51 @@ def destination_city(string, context):
 
     @param string: сообщение пользователя
     @param context: словарь для хранения полученной информации
-    @return: True - если в сообщении присутствует город назначения в доступных формах и есть рейс до него
+    @return: True - если в сообщении присутствует город назначения в доступных формах или с опечаткой
+    (рейс может быть и с пересадками)
     """
     cities = tt.get_destination_city()
-    for city, reformat in tt.reformat_city(cities):
-        destination_city = re.search(r'\b{}'.format(reformat.lower()), string.lower())
-        if destination_city:
-            context['destination_city'] = city
-            return True
+    city = find_city(string, cities)
+    if city is not None and city == context['departure_city']:
+        context['failure'] = 'same_city'
+        return False
+    if city is not None:
+        context['destination_city'] = city
+        return True
+
+    # Без прямого рейса город тоже подходит: маршрут с пересадками подберет хэндлер date.
+    # context['destination'] - только текст подсказки, подбор всегда идет по полному списку городов,
+    # иначе каждая следующая ошибка сужала бы подсказку до предыдущей
+    context['destination'] = suggest_cities(string, cities)
     return False
 
 
+def find_city(string, cities):
+    """
+    Функция поиска города в сообщении: сначала по основе названия, затем с учетом опечаток
+
+    @param string: сообщение пользователя
+    @param cities: список доступных городов
+    @return: найденный город или None
+    """
+    for city, reformat in tt.reformat_city(cities):
+        if re.search(r'\b{}'.format(reformat.lower()), string.lower()):
+            return city
+    return tt.city_index(cities).search(string)
+
+
+def suggest_cities(string, cities):
+    """
+    Функция подбора короткого списка городов для сообщения об ошибке
+
+    @param string: сообщение пользователя
+    @param cities: список доступных городов
+    @return: похожие города, либо первые tt.SUGGESTIONS городов, если похожих нет
+    """
+    index = tt.city_index(cities)
+    return index.suggest(string, tt.SUGGESTIONS) or index.cities[:tt.SUGGESTIONS]
+
+
 def comment(string, context):
     """
     Хэндлер проверки правильности ввода комментария
@@ -149,12 +231,15 @@ def flight_number(string, context):
 
     @param string: сообщение пользователя
     @param context: словарь для хранения полученной информации
-    @return: True - если сообщение содержит число от 1 до 5
+    @return: True - если сообщение содержит номер одного из предложенных рейсов
     """
-    flight_number = re.search(re_count, string)
-    if flight_number:
-        number = flight_number[0]
-        context['date'] = context['suitable_flights'][int(number) - 1]
+    # Номеров больше пяти, когда к ближайшим рейсам добавлены рейсы в соседние дни
+    flight_number = re.search(re_number, string)
+    if flight_number and 1 <= int(flight_number[0]) <= len(context['suitable_flights']):
+        index = int(flight_number[0]) - 1
+        context['date'] = context['suitable_flights'][index]
+        if context.get('connections'):
+            context['legs'] = context['connections'][index]
         return True
     return False
 
@@ -175,6 +260,24 @@ def restart(string, context):
 
 
 def generate_image(string, context):
-    ticket = TicketCreator(context)
+    # PIL импортируется при первой генерации билета, а не при запуске бота
+    from ticket_create import LayeredTicketCreator
+    ticket = LayeredTicketCreator(context)
     return ticket.create()
 
+
+def generate_group_images(string, context):
+    """
+    Хэндлер генерации отдельного билета на каждого пассажира брони.
+    Включается указанием "image": "generate_group_images" у последнего шага сценария в settings.SCENARIO.
+    Имена пассажиров берутся из context['passengers'] (список по числу мест), если его заполнил шаг сценария,
+    иначе на каждом билете печатается имя покупателя
+
+    @param string: сообщение пользователя
+    @param context: словарь с данными брони
+    @return: список изображений билетов
+    """
+    from ticket_create import LayeredTicketCreator
+    ticket = LayeredTicketCreator(context)
+    return ticket.create_batch()
+
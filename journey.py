@@ -0,0 +1,206 @@
+"""
+Модуль поиска маршрутов с пересадками
+
+    JourneyPlanner - поиск самого раннего прибытия с ограничением на количество пересадок
+    get_planner - планировщик для текущего расписания, строится один раз на версию файла
+    itinerary_formatter - форматирование маршрута в строку
+
+Расписание хранит только время вылета, поэтому время в пути считается равным FLIGHT_DURATION.
+"""
+
+import bisect
+import datetime
+from array import array
+from collections import defaultdict
+
+import Timetable as tt
+
+FLIGHT_DURATION = datetime.timedelta(hours=3)
+MIN_CONNECTION = datetime.timedelta(hours=1)
+MAX_STOPS = 2
+HORIZON = datetime.timedelta(days=30)
+PERIOD_AHEAD = datetime.timedelta(days=180)
+
+
+def to_minutes(moment: datetime.datetime):
+    return moment.toordinal() * 1440 + moment.hour * 60 + moment.minute
+
+
+def from_minutes(minutes: int):
+    day, minute = divmod(minutes, 1440)
+    return datetime.datetime.fromordinal(day) + datetime.timedelta(minutes=minute)
+
+
+def expand(route: tt.Route, start: datetime.date, end: datetime.date):
+    """
+    Функция развертывания расписания маршрута в список вылетов
+
+    @param route: маршрут
+    @param start: первый день развертывания переодичных рейсов
+    @param end: последний день
+    @return: отсортированный array вылетов в минутах от начала календаря
+    """
+    first, last = start.toordinal(), end.toordinal()
+    departures = [to_minutes(date) for date in route.dates]
+    for weekday, time in route.weekly:
+        # date.fromordinal(1) - понедельник, поэтому день недели ординала равен (ordinal - 1) % 7
+        day = first + (weekday - (first - 1)) % 7
+        departures.extend(ordinal * 1440 + time.hour * 60 + time.minute for ordinal in range(day, last + 1, 7))
+
+    for monthday, time in route.monthly:
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            ordinal = datetime.date(year, month, monthday).toordinal()
+            if first <= ordinal <= last:
+                departures.append(ordinal * 1440 + time.hour * 60 + time.minute)
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return array('q', sorted(departures))
+
+
+class JourneyPlanner:
+    """
+    Класс поиска маршрутов по расписанию.
+    При создании расписание каждого маршрута разворачивается в отсортированный массив вылетов (в минутах),
+    поэтому ближайший вылет находится бинарным поиском.
+    Поиск идет раундами (как в RAPTOR): в раунде k известно самое раннее прибытие в каждый город
+    не более чем за k перелетов. Из города вылетаем ближайшим рейсом не раньше прибытия + MIN_CONNECTION.
+    Рассматриваются только города, из которых цель достижима за оставшиеся перелеты,
+    и прибытия позже уже найденного прибытия в цель отбрасываются.
+    """
+
+    def __init__(self, routes: dict, start: datetime.date = None, end: datetime.date = None):
+        # Переодичные рейсы разворачиваются на все расписание и на PERIOD_AHEAD вперед от текущего дня
+        today = datetime.date.today()
+        dates = [date.date() for route in routes.values() for date in route.dates]
+        start = start or min(dates + [today])
+        end = end or max(dates + [today + PERIOD_AHEAD]) + HORIZON
+
+        self.departures = {}
+        self.adjacency, self.reverse = defaultdict(set), defaultdict(set)
+        for (dep, dest), route in routes.items():
+            self.departures[(dep, dest)] = expand(route, start, end)
+            self.adjacency[dep].add(dest)
+            self.reverse[dest].add(dep)
+
+    def reachable(self, dest: str, legs: int):
+        """
+        Функция получения городов, из которых можно попасть в dest
+
+        @return: список множеств, i-е множество - города, откуда dest достижим не более чем за i перелетов
+        """
+        result = [{dest}]
+        for _ in range(legs):
+            previous = result[-1]
+            result.append(previous | {city for target in previous for city in self.reverse[target]})
+        return result
+
+    def earliest(self, dep: str, dest: str, after: datetime.datetime, max_stops: int = MAX_STOPS):
+        """
+        Функция поиска маршрутов с самым ранним прибытием
+
+        @param dep: город отправления
+        @param dest: город назначения
+        @param after: время, не раньше которого нужен первый вылет
+        @param max_stops: максимальное количество пересадок
+        @return: словарь {количество пересадок: список перелетов [(откуда, куда, вылет, прибытие)]},
+        маршрут с большим числом пересадок возвращается, только если он прибывает раньше
+        """
+        if dep == dest:
+            return {}
+        max_legs = max_stops + 1
+        reachable = self.reachable(dest, max_legs)
+        duration, connection = FLIGHT_DURATION // datetime.timedelta(minutes=1), \
+            MIN_CONNECTION // datetime.timedelta(minutes=1)
+        start = to_minutes(after)
+        best = start + HORIZON // datetime.timedelta(minutes=1) + duration
+
+        # labels[city] = (время прибытия, перелеты до города в виде (откуда, куда, вылет))
+        labels = {dep: (start - connection, ())}
+        marked, found = [dep], {}
+        for legs in range(1, max_legs + 1):
+            improved = {}
+            # Сначала перелеты сразу в цель: найденное прибытие отсекает остальные ветви раунда
+            targets = [{dest}, reachable[max_legs - legs] - {dest, dep}]
+            # Из промежуточного города нужен еще хотя бы один перелет с пересадкой
+            slack = duration + connection
+            for group, extra in zip(targets, (0, slack)):
+                for city in marked:
+                    arrival, path = labels[city]
+                    ready = arrival + connection
+                    if ready + duration + extra >= best:
+                        continue
+                    for target in self.adjacency[city] & group:
+                        departures = self.departures[(city, target)]
+                        index = bisect.bisect_left(departures, ready)
+                        if index == len(departures):
+                            continue
+                        target_arrival = departures[index] + duration
+                        if target_arrival + extra >= best:
+                            continue
+                        known = improved.get(target) or labels.get(target)
+                        if known is None or target_arrival < known[0]:
+                            improved[target] = (target_arrival, path + ((city, target, departures[index]),))
+                if dest in improved:
+                    best = improved[dest][0]
+
+            labels.update(improved)
+            if dest in improved:
+                found[legs - 1] = [(city, target, from_minutes(departure), from_minutes(departure + duration))
+                                   for city, target, departure in improved[dest][1]]
+            marked = sorted((city for city in improved if city != dest), key=lambda city: improved[city][0])
+
+        return found
+
+    def plan(self, dep: str, dest: str, after: datetime.datetime, count: int = 5, max_stops: int = MAX_STOPS):
+        """
+        Функция поиска нескольких вариантов маршрута
+
+        @param dep: город отправления
+        @param dest: город назначения
+        @param after: время, не раньше которого нужен первый вылет
+        @param count: количество вариантов
+        @param max_stops: максимальное количество пересадок
+        @return: до count маршрутов, отсортированных по времени вылета
+        """
+        itineraries = []
+        while len(itineraries) < count:
+            found = self.earliest(dep, dest, after, max_stops)
+            if not found:
+                break
+            # Из вариантов с разным числом пересадок берем прибывающий раньше
+            itinerary = found[max(found)]
+            itineraries.append(itinerary)
+            # Следующий вариант ищем с вылетом позже первого перелета найденного
+            after = itinerary[0][2] + datetime.timedelta(minutes=1)
+
+        return itineraries
+
+
+_planner = ((None, None), None)
+
+
+def get_planner():
+    """
+    Функция получения планировщика для текущего расписания
+
+    @return: JourneyPlanner, построенный по tt.get_routes
+    """
+    global _planner
+    # Планировщик перестраивается при изменении расписания и раз в день, чтобы сдвигать окно переодичных рейсов
+    key = (tt.get_routes(), datetime.date.today())
+    if _planner[0] != key:
+        _planner = (key, JourneyPlanner(key[0]))
+    return _planner[1]
+
+
+def itinerary_formatter(itinerary: list):
+    """
+    Функция форматирования маршрута
+
+    @param itinerary: список перелетов [(откуда, куда, вылет, прибытие)]
+    @return: строка вида 'dd-mm-YYYY HH:MM Москва → Рига → Берлин, прибытие dd-mm-YYYY HH:MM'
+    """
+    cities = [itinerary[0][0]] + [leg[1] for leg in itinerary]
+    return '{} {}, прибытие {}'.format(itinerary[0][2].strftime(tt.DATETIME), ' → '.join(cities),
+                                       itinerary[-1][3].strftime(tt.DATETIME))
@@ -1,10 +1,8 @@
-from pony.orm import Database, Required, Json
-from settings import DB_CONFIG
-from datetime import datetime
+from pony.orm import Database, Required, Optional, Json, composite_key, composite_index
+from datetime import date, datetime
 
 # psql \! chcp 1251 - смена кодировки
 db = Database()
-db.bind(**DB_CONFIG)
 
 
 class UserState(db.Entity):
@@ -12,6 +10,10 @@ class UserState(db.Entity):
     scenario_name = Required(str)
     step_name = Required(str)
     context = Required(Json)
+    # Время последнего сообщения, по нему sweeper удаляет брошенные сценарии
+    last_activity = Required(datetime, default=datetime.now, index=True)
+    # Увеличивается при каждой записи, по нему Bot.commit находит состояние, измененное другим обработчиком
+    version = Required(int, default=0)
 
 
 class Ticket(db.Entity):
@@ -21,6 +23,71 @@ class Ticket(db.Entity):
     date = Required(datetime)
     ticket_count = Required(int)
     commentary = Required(str)
+    seats = Optional(Json)
+    # Билеты пользователя и брони рейса выбираются по индексу, а не полным просмотром таблицы
+    composite_index(user_id, date)
+    composite_index(departure_city, destination_city, date)
 
 
-db.generate_mapping(create_tables=True)
+class RouteDayStats(db.Entity):
+    # Счетчики броней маршрута за день, обновляются вместе с созданием Ticket, см. модуль bookings
+    departure_city = Required(str)
+    destination_city = Required(str)
+    day = Required(date)
+    bookings = Required(int, default=0)
+    tickets = Required(int, default=0)
+    composite_key(departure_city, destination_city, day)
+
+
+class ProcessedEvent(db.Entity):
+    # Обработанные события ВКонтакте, общие для всех процессов бота, см. delivery.ProcessedEvents
+    event_key = Required(str, unique=True)
+    created = Required(datetime, default=datetime.now, index=True)
+
+
+class FlightSeats(db.Entity):
+    # Занятость мест рейса: бит i соответствует месту i + 1, см. модуль seats
+    departure_city = Required(str)
+    destination_city = Required(str)
+    date = Required(datetime)
+    occupied = Required(bytes)
+    composite_key(departure_city, destination_city, date)
+
+
+def insert_missing(entity, **values):
+    """
+    Вставка строки, если строки с тем же уникальным ключом еще нет: INSERT ... ON CONFLICT DO NOTHING
+    (PostgreSQL и SQLite 3.24+). Нужна перед get_for_update: SELECT ... FOR UPDATE не блокирует
+    несуществующую строку, и два обработчика, не найдя ее, вставили бы ее оба. Если строку вставляет
+    параллельная транзакция, INSERT дожидается ее завершения и ничего не делает
+
+    @param entity: класс сущности
+    @param values: значения всех обязательных атрибутов
+    @return: True - если строка вставлена, False - если она уже была
+    """
+    quote = db.provider.quote_name
+    attrs = [getattr(entity, name) for name in values]
+    columns = ', '.join(quote(attr.column) for attr in attrs)
+    params = ', '.join(f'$(values[{index}])' for index in range(len(attrs)))
+    # Значения приводятся конвертерами Pony, чтобы строка совпадала с записанной через ORM (например, формат дат SQLite)
+    converted = [attr.converters[0].py2sql(attr.converters[0].val2dbval(value))
+                 for attr, value in zip(attrs, values.values())]
+    cursor = db.execute(f'INSERT INTO {quote(entity._table_)} ({columns}) VALUES ({params}) ON CONFLICT DO NOTHING',
+                        {}, {'values': converted})
+    return cursor.rowcount > 0
+
+
+def init_db(config=None):
+    """
+    Подключение к базе данных и создание таблиц. Выполняется явно при запуске, а не при импорте модуля,
+    повторный вызов ничего не делает
+
+    @param config: параметры db.bind, по умолчанию settings.DB_CONFIG
+    """
+    if db.schema is not None:
+        return
+    if config is None:
+        from settings import DB_CONFIG
+        config = DB_CONFIG
+    db.bind(**config)
+    db.generate_mapping(create_tables=True)
@@ -0,0 +1,145 @@
+"""
+Модуль учета мест на рейсах
+
+    allocate - бронирование свободных мест на рейсе
+    allocate_legs - бронирование мест на всех перелетах маршрута с пересадками
+    release - освобождение мест
+    free_seats - количество свободных мест на рейсе
+    filter_available - отбор рейсов, на которых есть нужное количество свободных мест
+
+Рейс определяется маршрутом и датой вылета, занятость мест хранится битовой маской в models.FlightSeats.
+allocate, allocate_legs и release нужно вызывать внутри db_session. Строка рейса блокируется через
+SELECT ... FOR UPDATE, поэтому параллельные обработчики не могут выдать одно место дважды.
+Функции чтения открывают db_session сами и могут вызываться из фазы расчета бота.
+"""
+
+import random
+
+from pony.orm import db_session
+
+from models import FlightSeats, insert_missing
+
+SEAT_COUNT = 54
+BITMAP_SIZE = (SEAT_COUNT + 7) // 8
+
+
+class NotEnoughSeats(Exception):
+    pass
+
+
+def to_mask(occupied: bytes):
+    return int.from_bytes(occupied, 'little')
+
+
+def to_bytes(mask: int):
+    return mask.to_bytes(BITMAP_SIZE, 'little')
+
+
+def count_free(mask: int):
+    return SEAT_COUNT - bin(mask).count('1')
+
+
+def get_flight(dep: str, dest: str, date):
+    """
+    Функция получения заблокированной строки рейса.
+    Строка сначала вставляется, если ее нет, и только потом блокируется: SELECT ... FOR UPDATE
+    не блокирует отсутствующую строку, и первые брони на рейс вставили бы ее одновременно
+
+    @param dep: город отправления
+    @param dest: город назначения
+    @param date: дата и время вылета
+    @return: FlightSeats, при отсутствии создается рейс со всеми свободными местами
+    """
+    insert_missing(FlightSeats, departure_city=dep, destination_city=dest, date=date, occupied=to_bytes(0))
+    return FlightSeats.get_for_update(departure_city=dep, destination_city=dest, date=date)
+
+
+def allocate(dep: str, dest: str, date, count: int):
+    """
+    Функция бронирования мест
+
+    @param dep: город отправления
+    @param dest: город назначения
+    @param date: дата и время вылета
+    @param count: количество мест
+    @return: отсортированный список номеров мест
+    """
+    return allocate_legs([(dep, dest, date)], count)[0]
+
+
+def allocate_legs(legs: list, count: int):
+    """
+    Функция бронирования мест сразу на всех перелетах маршрута с пересадками.
+    Сначала блокируются и проверяются все рейсы, поэтому при нехватке мест ничего не бронируется
+
+    @param legs: список перелетов (откуда, куда, дата вылета)
+    @param count: количество мест
+    @return: список номеров мест для каждого перелета
+    """
+    flights = [get_flight(dep, dest, date) for dep, dest, date in legs]
+    free = []
+    for flight in flights:
+        mask = to_mask(flight.occupied)
+        free.append([seat for seat in range(1, SEAT_COUNT + 1) if not mask >> (seat - 1) & 1])
+        if len(free[-1]) < count:
+            raise NotEnoughSeats(f'{flight.departure_city} - {flight.destination_city} {flight.date}: '
+                                 f'free {len(free[-1])}, requested {count}')
+
+    result = []
+    for flight, available in zip(flights, free):
+        seats = sorted(random.sample(available, count))
+        mask = to_mask(flight.occupied)
+        for seat in seats:
+            mask |= 1 << (seat - 1)
+        flight.occupied = to_bytes(mask)
+        result.append(seats)
+
+    return result
+
+
+def release(dep: str, dest: str, date, seats: list):
+    """
+    Функция освобождения мест
+
+    @param dep: город отправления
+    @param dest: город назначения
+    @param date: дата и время вылета
+    @param seats: номера мест
+    """
+    flight = get_flight(dep, dest, date)
+    mask = to_mask(flight.occupied)
+    for seat in seats:
+        mask &= ~(1 << (seat - 1))
+    flight.occupied = to_bytes(mask)
+
+
+@db_session
+def free_seats(dep: str, dest: str, date):
+    """
+    Функция получения количества свободных мест
+
+    @return: количество свободных мест на рейсе
+    """
+    flight = FlightSeats.get(departure_city=dep, destination_city=dest, date=date)
+    return SEAT_COUNT if flight is None else count_free(to_mask(flight.occupied))
+
+
+@db_session
+def filter_available(dep: str, dest: str, dates: list, count: int = 1):
+    """
+    Функция отбора рейсов, на которых есть хотя бы count свободных мест. Выполняет один запрос на весь список
+
+    @param dep: город отправления
+    @param dest: город назначения
+    @param dates: список дат вылета (datetime)
+    @param count: необходимое количество мест
+    @return: даты из dates в исходном порядке
+    """
+    if not dates:
+        return []
+
+    flights = FlightSeats.select(lambda f: f.departure_city == dep and f.destination_city == dest
+                                 and f.date in dates)
+    full = {flight.date for flight in flights if count_free(to_mask(flight.occupied)) < count}
+
+    return [date for date in dates if date not in full]
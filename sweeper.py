@@ -0,0 +1,82 @@
+"""
+Модуль удаления брошенных сценариев
+
+    StateSweeper - фоновый поток, удаляющий UserState без активности дольше ttl
+"""
+
+import datetime
+import logging
+import threading
+
+from pony.orm import db_session
+
+from models import UserState
+
+log = logging.getLogger("bot")
+
+
+class StateSweeper(threading.Thread):
+    """
+    Фоновый поток очистки UserState.
+    Раз в interval секунд удаляет состояния, у которых last_activity старше ttl. Удаление идет пачками
+    по batch строк, каждая в своей короткой транзакции, поэтому обработка сообщений не блокируется надолго.
+    Если передан notify, он вызывается с user_id после удаления, вне транзакции.
+    Если передан cleanup, он вызывается после каждого прохода, например для очистки журнала событий
+    (delivery.ProcessedEvents.cleanup).
+    """
+
+    def __init__(self, ttl=24 * 60 * 60, interval=5 * 60, batch=500, notify=None, cleanup=None):
+        super().__init__(name='state-sweeper', daemon=True)
+        self.ttl = datetime.timedelta(seconds=ttl)
+        self.interval, self.batch, self.notify, self.cleanup = interval, batch, notify, cleanup
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                log.exception("state sweeper error")
+
+    def stop(self):
+        self.stopped.set()
+
+    def sweep(self):
+        """
+        Функция удаления устаревших состояний, после нее вызывается cleanup
+
+        @return: количество удаленных состояний
+        """
+        border = datetime.datetime.now() - self.ttl
+        removed = 0
+        while not self.stopped.is_set():
+            user_ids = self.sweep_batch(border)
+            removed += len(user_ids)
+            if self.notify is not None:
+                for user_id in user_ids:
+                    try:
+                        self.notify(user_id)
+                    except Exception:
+                        log.exception("state sweeper notify error")
+            if len(user_ids) < self.batch:
+                break
+
+        if removed:
+            log.info('state sweeper: removed %s expired states', removed)
+        if self.cleanup is not None:
+            try:
+                self.cleanup()
+            except Exception:
+                log.exception("state sweeper cleanup error")
+        return removed
+
+    @db_session
+    def sweep_batch(self, border):
+        # Выборка идет по индексу last_activity. Состояние, обновленное до выборки, в нее не попадает.
+        # Событие, загрузившее состояние до удаления, в Bot.commit увидит, что строки нет, и не создаст ее заново
+        states = UserState.select(lambda state: state.last_activity < border) \
+            .order_by(UserState.last_activity).for_update()[:self.batch]
+        user_ids = [state.user_id for state in states]
+        for state in states:
+            state.delete()
+        return user_ids
@@ -0,0 +1,93 @@
+import datetime
+import threading
+import unittest
+from unittest.mock import patch
+from pony.orm import db_session, rollback
+import bookings
+import models
+from models import RouteDayStats, Ticket, init_db
+
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+
+def isolate_db(funk):
+    def wrapper(*args, **kwargs):
+        with db_session:
+            funk(*args, **kwargs)
+            rollback()
+
+    return wrapper
+
+
+class MyTestCase(unittest.TestCase):
+    DAY = datetime.date(2021, 8, 10)
+
+    def add(self, user_id, dep, dest, hour, count, day=DAY):
+        moment = datetime.datetime.combine(day, datetime.time(hour))
+        bookings.add_ticket(user_id, dep, dest, moment, count, 'коммент', seats=list(range(1, count + 1)))
+
+    def fill(self):
+        self.add(1, 'Москва', 'Берлин', 7, 2)
+        self.add(2, 'Москва', 'Берлин', 19, 3)
+        self.add(1, 'Москва', 'Рига', 10, 1)
+        self.add(1, 'Москва', 'Берлин', 7, 1, day=self.DAY + datetime.timedelta(days=1))
+
+    @isolate_db
+    def test_counters(self):
+        self.fill()
+        next_day = self.DAY + datetime.timedelta(days=1)
+
+        assert bookings.route_stats('Москва', 'Берлин', self.DAY, next_day) == {self.DAY: (2, 5), next_day: (1, 1)}
+        assert bookings.daily_totals(self.DAY, self.DAY) == {self.DAY: (3, 6)}
+        assert bookings.top_routes(self.DAY, next_day, limit=1) == [('Москва', 'Берлин', 6)]
+
+    @isolate_db
+    def test_rebuild_stats(self):
+        self.fill()
+        before = {(s.departure_city, s.destination_city, s.day): (s.bookings, s.tickets)
+                  for s in RouteDayStats.select()}
+        bookings.rebuild_stats()
+        after = {(s.departure_city, s.destination_city, s.day): (s.bookings, s.tickets)
+                 for s in RouteDayStats.select()}
+
+        assert before == after
+
+    @isolate_db
+    def test_ticket_queries(self):
+        self.fill()
+
+        user = bookings.user_tickets(1)
+        assert [ticket['destination_city'] for ticket in user] == ['Берлин', 'Рига', 'Берлин']
+        assert len(bookings.user_tickets(1, since=datetime.datetime(2021, 8, 11))) == 1
+
+        start = datetime.datetime.combine(self.DAY, datetime.time())
+        route = bookings.route_tickets('Москва', 'Берлин', start, start + datetime.timedelta(days=1))
+        assert [ticket['ticket_count'] for ticket in route] == [2, 3]
+
+    def test_concurrent_first_booking(self):
+        # Другой обработчик вставляет строку счетчиков уже после того, как эта транзакция решила, что ее нет
+        day = self.DAY + datetime.timedelta(days=30)
+        started = threading.Event()
+
+        def book_in_other_thread():
+            with db_session:
+                self.add(2, 'Москва', 'Берлин', 19, 3, day=day)
+
+        def insert_missing(entity, **values):
+            if not started.is_set():
+                started.set()
+                thread = threading.Thread(target=book_in_other_thread)
+                thread.start()
+                thread.join()
+            models.insert_missing(entity, **values)
+
+        try:
+            with patch('bookings.insert_missing', side_effect=insert_missing):
+                with db_session:
+                    self.add(1, 'Москва', 'Берлин', 7, 2, day=day)
+
+            assert bookings.route_stats('Москва', 'Берлин', day, day) == {day: (2, 5)}
+        finally:
+            with db_session:
+                Ticket.select(lambda t: t.date.date() == day).delete(bulk=True)
+                RouteDayStats.select(lambda s: s.day == day).delete(bulk=True)
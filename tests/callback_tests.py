@@ -0,0 +1,76 @@
+import asyncio
+import socket
+import threading
+import unittest
+from unittest.mock import Mock
+from aiohttp import web
+from pony.orm import db_session
+import callback_client
+import settings
+from bot import Bot
+from callback_server import CallbackServer
+from models import ProcessedEvent, UserState, init_db
+
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+
+class MyTestCase(unittest.TestCase):
+    CONFIRMATION = 'a1b2c3d4'
+    SECRET = 'secret'
+
+    EXPECTED_OUTPUTS = [settings.INTENTS[0]['answer'],
+                        settings.SCENARIO['ticket_buy']['steps']['step1']['text'],
+                        'Вы успешно вышли из сценария']
+
+    def setUp(self):
+        self.bot = Bot('', '', long_poll=False)
+        self.bot.api = Mock()
+        self.bot.api.users.get = Mock(return_value=[{'first_name': '', 'last_name': ''}])
+        self.server = CallbackServer(self.bot, self.CONFIRMATION, secret=self.SECRET, workers=2)
+        self.server.start_workers()
+
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}{self.server.path}'
+
+        # Сервер работает в отдельном потоке со своим циклом событий, как при web.run_app
+        self.loop = asyncio.new_event_loop()
+
+        async def serve():
+            self.runner = web.AppRunner(self.server.make_app())
+            await self.runner.setup()
+            await web.TCPSite(self.runner, '127.0.0.1', port).start()
+
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(serve(), self.loop).result(timeout=5)
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.server.stop_workers()
+        with db_session:
+            ProcessedEvent.select().delete(bulk=True)
+            UserState.select().delete(bulk=True)
+
+    def test_recorded_events(self):
+        events = callback_client.load_events()
+        responses = callback_client.post_events(self.url, events, secret=self.SECRET)
+        self.server.join()
+
+        assert responses == [(200, self.CONFIRMATION)] + [(200, 'ok')] * (len(events) - 1)
+
+        real_outputs = [kwargs['message'] for args, kwargs in self.bot.api.messages.send.call_args_list]
+        # Повторно доставленное событие /ticket не обрабатывается второй раз
+        assert real_outputs == self.EXPECTED_OUTPUTS
+
+    def test_wrong_secret(self):
+        event = callback_client.load_events()[1]
+        responses = callback_client.post_events(self.url, [event], secret='wrong')
+        self.server.join()
+
+        assert responses[0][0] == 403
+        self.bot.api.messages.send.assert_not_called()
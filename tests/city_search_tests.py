@@ -0,0 +1,44 @@
+import unittest
+from unittest.mock import patch
+import handlers
+from city_search import CitySearch, levenshtein
+
+
+class MyTestCase(unittest.TestCase):
+    CITIES = ['Москва', 'Берлин', 'Бремен', 'Кёльн', 'Париж', 'Прага', 'Рига', 'Рим']
+
+    def setUp(self):
+        self.index = CitySearch(self.CITIES)
+
+    def test_levenshtein(self):
+        assert levenshtein('берлн', 'берлин', 2) == 1
+        assert levenshtein('москва', 'париж', 2) == 3
+
+    def test_search_with_typos(self):
+        assert self.index.search('Берлн') == 'Берлин'
+        assert self.index.search('хочу в Мосва') == 'Москва'
+        assert self.index.search('Кельн') == 'Кёльн'
+        assert self.index.search('фывфывф') is None
+
+    def test_suggest(self):
+        assert self.index.suggest('Парижж', 2)[0] == 'Париж'
+        assert self.index.suggest('фывфывф') == []
+
+
+class HandlersTestCase(unittest.TestCase):
+    CITIES = ['Москва', 'Берлин', 'Бремен', 'Кёльн', 'Париж', 'Прага', 'Рига', 'Рим']
+
+    def test_destination_suggestions_do_not_narrow(self):
+        context = {'departure_city': 'Москва', 'destination': ['Берлин']}
+        with patch('Timetable.get_destination_city', return_value=self.CITIES):
+            assert not handlers.destination_city('Брлнмн', context)
+            assert context['destination'] == ['Бремен']
+            # Подсказка после второй ошибки строится по всем городам, а не по предыдущей подсказке
+            assert not handlers.destination_city('Паррррриж', context)
+            assert context['destination'] == ['Париж']
+            assert handlers.destination_city('Парж', context)
+        assert context['destination_city'] == 'Париж'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+import datetime
+import unittest
+from unittest.mock import patch, Mock
+from pony.orm import db_session
+from vk_api.bot_longpoll import VkBotMessageEvent
+import delivery
+import settings
+from bot import Bot
+from models import ProcessedEvent, UserState, init_db
+
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+
+class MyTestCase(unittest.TestCase):
+    RAW_EVENT = {'type': 'message_new', 'event_id': 'e1b2c3',
+                 'object': {'message': {'peer_id': 177327125, 'text': 'привет', 'conversation_message_id': 7}},
+                 'group_id': 200916670}
+
+    def test_event_key(self):
+        event = VkBotMessageEvent(self.RAW_EVENT)
+        assert delivery.event_key(event) == 'e1b2c3'
+
+        raw = dict(self.RAW_EVENT)
+        del raw['event_id']
+        assert delivery.event_key(VkBotMessageEvent(raw)) == '177327125:7'
+
+    def test_random_id(self):
+        first = delivery.make_random_id(177327125, 'e1b2c3', 1)
+        assert first == delivery.make_random_id(177327125, 'e1b2c3', 1)
+        assert first != delivery.make_random_id(177327125, 'e1b2c3', 2)
+        assert 0 < first < 2 ** 31
+
+    def tearDown(self):
+        with db_session:
+            ProcessedEvent.select().delete(bulk=True)
+            UserState.select().delete(bulk=True)
+
+    def make_bot(self):
+        bot = Bot('', '', long_poll=False)
+        bot.api = Mock()
+        bot.api.users.get = Mock(return_value=[{'first_name': '', 'last_name': ''}])
+        return bot
+
+    def make_event(self, event_id, text):
+        raw = dict(self.RAW_EVENT, event_id=event_id)
+        raw['object'] = {'message': dict(self.RAW_EVENT['object']['message'], text=text)}
+        return VkBotMessageEvent(raw)
+
+    def test_processed_events(self):
+        processed = delivery.ProcessedEvents(size=2, ttl=600)
+        assert not processed.seen('a')
+        processed.add('a')
+        assert processed.seen('a')
+        processed.add('b')
+        processed.add('c')
+        # самое старое событие вытеснено
+        assert not processed.seen('a')
+
+        with patch('delivery.time.monotonic', side_effect=[0, 1000]):
+            processed = delivery.ProcessedEvents(ttl=600)
+            processed.add('a')
+            assert not processed.seen('a')
+
+    def test_claim(self):
+        processed = delivery.ProcessedEvents(ttl=600)
+        with db_session:
+            assert processed.claim('a')
+            assert not processed.claim('a')
+            ProcessedEvent(event_key='old', created=datetime.datetime.now() - datetime.timedelta(seconds=601))
+
+        # Устаревшие события удаляются при очистке
+        processed.cleanup()
+        with db_session:
+            assert not ProcessedEvent.exists(event_key='old') and ProcessedEvent.exists(event_key='a')
+
+    def test_duplicate_event(self):
+        send_mock = Mock()
+        events = [VkBotMessageEvent(self.RAW_EVENT), VkBotMessageEvent(self.RAW_EVENT)]
+        long_poller_mock = Mock()
+        long_poller_mock.listen = Mock(return_value=events)
+
+        with patch('bot.VkBotLongPoll', return_value=long_poller_mock):
+            bot = Bot('', '')
+            bot.api = Mock()
+            bot.api.messages.send = send_mock
+            bot.run()
+
+        assert send_mock.call_count == 1
+
+    def test_duplicate_in_other_process(self):
+        # Журнал событий общий: дубль, принятый другим процессом, не обрабатывается
+        first, second = self.make_bot(), self.make_bot()
+        first.process(VkBotMessageEvent(self.RAW_EVENT))
+        second.process(VkBotMessageEvent(self.RAW_EVENT))
+
+        assert first.api.messages.send.call_count == 1
+        second.api.messages.send.assert_not_called()
+
+    def test_duplicate_claimed_during_handling(self):
+        # Другой процесс записал то же событие, пока этот его обрабатывал: ответ не отправляется
+        first, second = self.make_bot(), self.make_bot()
+        handle_message = second.handle_message
+
+        def handle_with_competitor(ctx):
+            first.process(VkBotMessageEvent(self.RAW_EVENT))
+            handle_message(ctx)
+
+        with patch.object(second, 'handle_message', side_effect=handle_with_competitor):
+            second.process(VkBotMessageEvent(self.RAW_EVENT))
+
+        assert first.api.messages.send.call_count == 1
+        second.api.messages.send.assert_not_called()
+
+    def test_state_conflict_retried(self):
+        # Пока событие обрабатывалось, другой процесс начал сценарий того же пользователя
+        first, second = self.make_bot(), self.make_bot()
+        handle_message, calls = second.handle_message, []
+
+        def handle_with_competitor(ctx):
+            calls.append(ctx.loaded_state)
+            if len(calls) == 1:
+                first.process(self.make_event('e1', '/ticket'))
+            handle_message(ctx)
+
+        with patch.object(second, 'handle_message', side_effect=handle_with_competitor):
+            second.process(self.make_event('e2', '/ticket'))
+
+        # Первая попытка считалась без состояния, повторная - по состоянию, записанному другим процессом
+        assert calls[0] is None and calls[1].version == 0
+        outputs = [call[1]['message'] for call in second.api.messages.send.call_args_list]
+        assert outputs == ['Вы успешно вышли из сценария', settings.SCENARIO['ticket_buy']['steps']['step1']['text']]
+        with db_session:
+            assert UserState.get(user_id='177327125').version == 1
+
+    def test_db_hold_report(self):
+        # Статистика пишется из process, поэтому и в режиме Callback API
+        bot = self.make_bot()
+        with patch('bot.DB_REPORT_EVERY', 2), patch.object(bot, 'db_hold_report', return_value={}) as report:
+            for _ in range(4):
+                bot.process(Mock(type='typing'))
+        assert report.call_count == 2
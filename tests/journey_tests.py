@@ -0,0 +1,150 @@
+import datetime
+import unittest
+from unittest.mock import patch
+from pony.orm import db_session, rollback
+import handlers
+import seats
+import Timetable as tt
+from journey import JourneyPlanner, itinerary_formatter
+from models import init_db
+
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+
+class MyTestCase(unittest.TestCase):
+    # Прямого рейса Москва - Берлин нет
+    FLIGHTS = [('Москва', 'Рига', '10:00', 'Monday'),
+               ('Рига', 'Берлин', '13:30', 'Monday'),
+               ('Москва', 'Варшава', '08:00', 'Monday'),
+               ('Варшава', 'Прага', '12:00', 'Monday'),
+               ('Прага', 'Берлин', '16:00', 'Monday'),
+               ('Рига', 'Берлин', '20-04-2021 09:00', '')]
+
+    def setUp(self):
+        routes = {}
+        for dep, dest, time, period in self.FLIGHTS:
+            routes.setdefault((dep, dest), tt.Route(dep, dest)).add(time, period)
+        self.planner = JourneyPlanner(routes, datetime.date(2021, 4, 1), datetime.date(2021, 6, 1))
+
+    def test_earliest(self):
+        found = self.planner.earliest('Москва', 'Берлин', datetime.datetime(2021, 4, 12))
+
+        # Через Ригу пересадка на рейс 13:30 короче MIN_CONNECTION, поэтому с 1 пересадкой прибытие только 19-го
+        assert itinerary_formatter(found[1]) == '12-04-2021 10:00 Москва → Рига → Берлин, прибытие 19-04-2021 16:30'
+        assert itinerary_formatter(found[2]) == \
+            '12-04-2021 08:00 Москва → Варшава → Прага → Берлин, прибытие 12-04-2021 19:00'
+
+    def test_max_stops(self):
+        found = self.planner.earliest('Москва', 'Берлин', datetime.datetime(2021, 4, 12), max_stops=1)
+
+        assert list(found) == [1]
+
+    def test_plan(self):
+        itineraries = self.planner.plan('Москва', 'Берлин', datetime.datetime(2021, 4, 12), count=2)
+
+        assert [itinerary[0][2] for itinerary in itineraries] == [datetime.datetime(2021, 4, 12, 8),
+                                                                   datetime.datetime(2021, 4, 12, 10)]
+
+    def test_same_city(self):
+        assert self.planner.earliest('Москва', 'Москва', datetime.datetime(2021, 4, 12)) == {}
+
+
+class HandlersTestCase(unittest.TestCase):
+    FLIGHTS = MyTestCase.FLIGHTS[:-1]
+
+    def setUp(self):
+        routes = {}
+        for dep, dest, time, period in self.FLIGHTS:
+            routes.setdefault((dep, dest), tt.Route(dep, dest)).add(time, period)
+        self.planner = JourneyPlanner(routes)
+        today = datetime.date.today()
+        self.monday = today + datetime.timedelta(days=7 - today.weekday())
+        self.context = {'departure_city': 'Москва', 'destination_city': 'Берлин'}
+
+    def date(self, context):
+        with patch('journey.get_planner', return_value=self.planner), \
+                patch('Timetable.get_destination', return_value=[]):
+            return handlers.date(self.monday.strftime(tt.DATE), context)
+
+    @db_session
+    def test_connections(self):
+        assert self.date(self.context)
+        first = self.context['connections'][0]
+        assert first[0][:2] == ['Москва', 'Варшава']
+
+        # Рейс Варшава - Прага заполнен: маршруты с этим перелетом не предлагаются
+        dep, dest, departure = first[1]
+        seats.allocate(dep, dest, datetime.datetime.strptime(departure, tt.DATETIME), seats.SEAT_COUNT)
+        context = {'departure_city': 'Москва', 'destination_city': 'Берлин'}
+        assert self.date(context)
+        assert context['connections']
+        assert all([dep, dest, departure] not in legs for legs in context['connections'])
+        rollback()
+
+    def test_no_route(self):
+        self.planner = JourneyPlanner({})
+        assert not self.date(self.context)
+        assert self.context['failure'] == 'no_route'
+
+    def test_flight_number_bounds(self):
+        context = {'suitable_flights': ['10-11-2021 23:10']}
+        assert not handlers.flight_number('3', context)
+        assert handlers.flight_number('1', context)
+        assert context['date'] == '10-11-2021 23:10'
+
+    def test_same_destination(self):
+        context = {'departure_city': 'Москва'}
+        with patch('Timetable.get_destination_city', return_value=['Москва', 'Берлин']):
+            assert not handlers.destination_city('Москва', context)
+        assert context['failure'] == 'same_city'
+
+
+class DirectRouteTestCase(unittest.TestCase):
+    def setUp(self):
+        self.day = datetime.date.today() + datetime.timedelta(days=14)
+        self.monthly = datetime.datetime.combine(self.day + datetime.timedelta(days=1), datetime.time(21, 44))
+        self.weekly = datetime.datetime.combine(self.day + datetime.timedelta(days=2), datetime.time(7, 34))
+        self.once = datetime.datetime.combine(self.day - datetime.timedelta(days=1), datetime.time(18, 8))
+
+        route = tt.Route('Москва', 'Берлин')
+        route.add('21:44', str(self.monthly.day))
+        route.add('07:34', tt.WEEKDAYS[self.weekly.weekday()])
+        route.add(self.once.strftime(tt.DATETIME), '')
+        self.routes = {('Москва', 'Берлин'): route}
+
+    def test_get_date_monthly(self):
+        with patch('Timetable.get_routes', return_value=self.routes):
+            found = tt.get_date('Москва', 'Берлин', self.day.strftime(tt.DATE))
+
+        assert found[:2] == [self.monthly.strftime(tt.DATETIME), self.weekly.strftime(tt.DATETIME)]
+        assert len(found) == 5
+        assert self.once.strftime(tt.DATETIME) not in found
+
+    @db_session
+    def test_window_selectable(self):
+        context = {'departure_city': 'Москва', 'destination_city': 'Берлин'}
+        with patch('Timetable.get_routes', return_value=self.routes), \
+                patch('Timetable.get_destination', return_value=['Берлин']):
+            assert handlers.date(self.day.strftime(tt.DATE), context)
+
+        # Рейс за день до введенной даты есть только в окне и продолжает нумерацию ближайших рейсов
+        assert len(context['suitable_flights']) == 6
+        assert f"{self.once.strftime(tt.DATE)}: 6) 18:08" in context['flights_to_print']
+        assert handlers.flight_number('6', context)
+        assert context['date'] == self.once.strftime(tt.DATETIME)
+        assert not handlers.flight_number('0', context) and not handlers.flight_number('7', context)
+
+    def test_calendar_formatter(self):
+        window = {'09-08-2021': {('Москва', 'Берлин'): ['07:34', '21:44']},
+                  '10-08-2021': {('Москва', 'Берлин'): ['07:34'], ('Москва', 'Рига'): ['10:00']}}
+
+        assert tt.calendar_formatter({'09-08-2021': window['09-08-2021']}, 3) == '09-08-2021: 3) 07:34, 4) 21:44'
+        assert tt.calendar_formatter(window).split('\n') == [
+            '09-08-2021: Москва - Берлин 1) 07:34, 2) 21:44',
+            '10-08-2021: Москва - Берлин 3) 07:34; Москва - Рига 4) 10:00']
+        # Номера календаря совпадают с позициями в window_flights
+        assert tt.window_flights(window)[3] == '10-08-2021 10:00'
+
+
+if __name__ == '__main__':
+    unittest.main()
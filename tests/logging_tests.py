@@ -0,0 +1,72 @@
+import json
+import logging
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+from bot_logging import JsonFormatter, RateLimitFilter, create_log
+
+
+def make_record(msg, *args, exc_info=None, **extra):
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, msg, args, exc_info)
+    record.__dict__.update(extra)
+    return record
+
+
+class MyTestCase(unittest.TestCase):
+
+    def test_json_formatter(self):
+        data = json.loads(JsonFormatter().format(make_record('event %s', 1, peer_id=10, step='step1')))
+
+        assert data['message'] == 'event 1'
+        assert data['peer_id'] == 10 and data['step'] == 'step1'
+        assert 'latency' not in data and 'exception' not in data
+
+    def test_json_formatter_exception(self):
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = make_record('error', exc_info=sys.exc_info())
+        data = json.loads(JsonFormatter().format(record))
+
+        assert data['message'] == 'error'
+        assert 'ValueError: boom' in data['exception']
+
+    def test_rate_limit(self):
+        rate_filter = RateLimitFilter(rate=2, period=60)
+        with patch('bot_logging.time.monotonic', return_value=0):
+            passed = [rate_filter.filter(make_record('Unknown event %s', 'typing')) for _ in range(5)]
+            other = rate_filter.filter(make_record('Unknown event %s', 'reply'))
+            unrelated = [rate_filter.filter(make_record('event handled')) for _ in range(5)]
+
+        assert passed == [True, True, False, False, False]
+        assert other and all(unrelated)
+
+        # В новом окне первая запись сообщает о количестве отброшенных
+        with patch('bot_logging.time.monotonic', return_value=60):
+            record = make_record('Unknown event %s', 'typing')
+            assert rate_filter.filter(record)
+        assert record.getMessage() == 'Unknown event typing (повторов отброшено: 3)'
+
+    def test_queued_structured_exception(self):
+        filename = os.path.join(tempfile.mkdtemp(), 'test.log')
+        logger = logging.getLogger('logging_tests')
+        listener = create_log(logger, filename=filename, queued=True, structured=True)
+        try:
+            try:
+                raise ValueError('boom')
+            except ValueError:
+                logger.exception('event handling error', extra={'peer_id': 10})
+        finally:
+            listener.stop()
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+
+        with open(filename, encoding='utf8') as ff:
+            data = json.loads(ff.readline())
+
+        assert data['message'] == 'event handling error'
+        assert data['peer_id'] == 10
+        assert 'ValueError: boom' in data['exception']
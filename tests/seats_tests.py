@@ -0,0 +1,76 @@
+import datetime
+import threading
+import unittest
+from unittest.mock import patch
+from pony.orm import db_session, rollback
+import models
+import seats
+from models import FlightSeats, init_db
+
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+
+def isolate_db(funk):
+    def wrapper(*args, **kwargs):
+        with db_session:
+            funk(*args, **kwargs)
+            rollback()
+
+    return wrapper
+
+
+class MyTestCase(unittest.TestCase):
+    ROUTE = ('Москва', 'Берлин')
+    DATE = datetime.datetime(2021, 8, 10, 7, 54)
+
+    @isolate_db
+    def test_allocate_unique_seats(self):
+        first = seats.allocate(*self.ROUTE, self.DATE, 50)
+        second = seats.allocate(*self.ROUTE, self.DATE, 4)
+
+        assert len(set(first + second)) == seats.SEAT_COUNT
+        assert seats.free_seats(*self.ROUTE, self.DATE) == 0
+        with self.assertRaises(seats.NotEnoughSeats):
+            seats.allocate(*self.ROUTE, self.DATE, 1)
+
+    @isolate_db
+    def test_release_and_filter(self):
+        other_date = self.DATE + datetime.timedelta(days=1)
+        taken = seats.allocate(*self.ROUTE, self.DATE, seats.SEAT_COUNT)
+
+        assert seats.filter_available(*self.ROUTE, [self.DATE, other_date]) == [other_date]
+        seats.release(*self.ROUTE, self.DATE, taken[:3])
+        assert seats.filter_available(*self.ROUTE, [self.DATE, other_date], 3) == [self.DATE, other_date]
+
+    def test_concurrent_first_booking(self):
+        # Другой обработчик вставляет строку рейса уже после того, как эта транзакция решила, что рейса нет
+        date = self.DATE + datetime.timedelta(days=30)
+        competitor, started = [], threading.Event()
+
+        def book_in_other_thread():
+            with db_session:
+                competitor.extend(seats.allocate(*self.ROUTE, date, 10))
+
+        def insert_missing(entity, **values):
+            if not started.is_set():
+                started.set()
+                thread = threading.Thread(target=book_in_other_thread)
+                thread.start()
+                thread.join()
+            models.insert_missing(entity, **values)
+
+        try:
+            with patch('seats.insert_missing', side_effect=insert_missing):
+                with db_session:
+                    mine = seats.allocate(*self.ROUTE, date, 5)
+
+            assert len(competitor) == 10
+            assert not set(mine) & set(competitor)
+            assert seats.free_seats(*self.ROUTE, date) == seats.SEAT_COUNT - 15
+        finally:
+            with db_session:
+                FlightSeats.select(lambda f: f.date == date).delete(bulk=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import datetime
+import unittest
+from unittest.mock import patch, Mock
+from pony.orm import db_session, select
+from bot import Bot, EventContext, ScenarioState, TIMEOUT_TEXT
+from models import UserState, init_db
+from sweeper import StateSweeper
+
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+
+class MyTestCase(unittest.TestCase):
+    TTL = 60 * 60
+
+    def setUp(self):
+        self.sweeper = StateSweeper(ttl=self.TTL, batch=2)
+
+    def tearDown(self):
+        with db_session:
+            UserState.select().delete(bulk=True)
+
+    @db_session
+    def add_states(self, age, *user_ids):
+        for user_id in user_ids:
+            UserState(user_id=str(user_id), scenario_name='ticket_buy', step_name='step1', context={},
+                      last_activity=datetime.datetime.now() - datetime.timedelta(seconds=age))
+
+    @db_session
+    def user_ids(self):
+        return set(select(state.user_id for state in UserState))
+
+    def test_batches(self):
+        self.add_states(self.TTL + 60, *range(5))
+        self.add_states(0, 10)
+
+        with patch.object(self.sweeper, 'sweep_batch', wraps=self.sweeper.sweep_batch) as sweep_batch:
+            assert self.sweeper.sweep() == 5
+        # Пачки по 2 строки: 2, 2 и последняя неполная
+        assert sweep_batch.call_count == 3
+        assert self.user_ids() == {'10'}
+
+    def test_ttl_border(self):
+        self.add_states(self.TTL + 60, 1)
+        self.add_states(self.TTL - 60, 2)
+
+        assert self.sweeper.sweep() == 1
+        assert self.user_ids() == {'2'}
+
+    def test_notify(self):
+        self.add_states(self.TTL + 60, 1, 2, 3)
+        # Ошибка уведомления одного пользователя не мешает остальным
+        self.sweeper.notify = Mock(side_effect=[ValueError, None, None])
+
+        assert self.sweeper.sweep() == 3
+        assert sorted(call[0][0] for call in self.sweeper.notify.call_args_list) == ['1', '2', '3']
+
+    def test_cleanup(self):
+        # Очистка журнала событий идет после прохода, даже если удалять нечего
+        self.sweeper.cleanup = Mock()
+        assert self.sweeper.sweep() == 0
+        self.sweeper.cleanup.assert_called_once()
+
+
+class CommitTestCase(unittest.TestCase):
+    USER_ID = 177327125
+
+    def setUp(self):
+        self.bot = Bot('', '', long_poll=False)
+        self.bot.api = Mock()
+
+    def tearDown(self):
+        with db_session:
+            UserState.select().delete(bulk=True)
+
+    def commit(self, ctx):
+        with db_session:
+            self.bot.commit(ctx)
+        for action in ctx.outbox:
+            action()
+        with db_session:
+            return UserState.get(user_id=str(self.USER_ID))
+
+    def test_swept_state_not_recreated(self):
+        # Состояние загружено, а до записи удалено сборщиком
+        ctx = EventContext(self.USER_ID, 'Москва')
+        ctx.state = ctx.loaded_state = ScenarioState('ticket_buy', 'step2', {'departure_city': 'Москва'})
+        ctx.state.step_name = 'step3'
+        ctx.outbox.append(Mock())
+
+        assert self.commit(ctx) is None
+        assert [call[1]['message'] for call in self.bot.api.messages.send.call_args_list] == [TIMEOUT_TEXT]
+
+    def test_swept_state_not_booked(self):
+        ctx = EventContext(self.USER_ID, 'да')
+        ctx.loaded_state = ScenarioState('ticket_buy', 'step8', {})
+        ctx.booking = ctx.loaded_state.context
+
+        with patch.object(self.bot, 'book') as book:
+            assert self.commit(ctx) is None
+        book.assert_not_called()
+
+    def test_new_scenario_after_sweep(self):
+        # Новый сценарий, начатый этим же событием, записывается
+        ctx = EventContext(self.USER_ID, '/ticket')
+        ctx.loaded_state = ScenarioState('ticket_buy', 'step2', {})
+        ctx.state = ScenarioState('ticket_buy', 'step1', {})
+
+        row = self.commit(ctx)
+        assert row is not None and row.step_name == 'step1'
+        self.bot.api.messages.send.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,21 @@
 import datetime
 import unittest
 from copy import deepcopy
+from pathlib import Path
 from unittest.mock import patch, Mock
 from pony.orm import db_session, rollback
+from pony.orm.core import local
 from vk_api.bot_longpoll import VkBotMessageEvent
 import settings
 from bot import Bot
+from models import UserState, Ticket, RouteDayStats, FlightSeats, init_db
 import ticket_create as tc
 
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+# Небольшое расписание вместо files/flights.csv, который создается timetable_creation
+FLIGHTS = Path(__file__).resolve().parent / 'flights.csv'
+
 
 def isolate_db(funk):
     def wrapper(*args, **kwargs):
@@ -86,12 +94,7 @@ class MyTestCase(unittest.TestCase):
                 bot.on_event.assert_any_call({})
                 assert bot.on_event.call_count == count
 
-    @isolate_db
-    def test_run_ok(self):
-        send_mock = Mock()
-        api_mock = Mock()
-        api_mock.messages.send = send_mock
-
+    def run_scenario(self, api_mock, send_image):
         events = []
         for input_text in self.INPUTS:
             event = deepcopy(self.RAW_EVENT)
@@ -101,14 +104,24 @@ class MyTestCase(unittest.TestCase):
         long_poller_mock = Mock()
         long_poller_mock.listen = Mock(return_value=events)
 
-        with patch('bot.VkBotLongPoll', return_value=long_poller_mock):
+        with patch('bot.VkBotLongPoll', return_value=long_poller_mock), patch('Timetable.FLIGHTS', FLIGHTS):
             with patch('Timetable.get_departure_city', return_value=['Москва']):
                 with patch('Timetable.get_date', return_value=['10-11-2001 23:10']):
-                    bot = Bot('', '')
-                    bot.api = api_mock
-                    api_mock.users.get = Mock(return_value=[{'first_name': '', 'last_name': ''}])
-                    bot.send_image = Mock()
-                    bot.run()
+                    with patch('Timetable.get_date_window', return_value={}):
+                        bot = Bot('', '')
+                        bot.api = api_mock
+                        bot.send_image = send_image
+                        bot.run()
+        return bot
+
+    @isolate_db
+    def test_run_ok(self):
+        send_mock = Mock()
+        api_mock = Mock()
+        api_mock.messages.send = send_mock
+        api_mock.users.get = Mock(return_value=[{'first_name': '', 'last_name': ''}])
+
+        bot = self.run_scenario(api_mock, Mock())
 
         assert bot.send_image.call_count == 1
         assert send_mock.call_count == len(self.INPUTS)
@@ -120,6 +133,31 @@ class MyTestCase(unittest.TestCase):
 
         assert real_outputs == self.EXPECTED_OUTPUTS
 
+    def test_vk_calls_outside_db_session(self):
+        sessions = []
+
+        def vk_call(*args, **kwargs):
+            # Запрос к ВКонтакте не должен выполняться при открытой db_session
+            sessions.append(local.db_session)
+            return [{'first_name': '', 'last_name': ''}]
+
+        api_mock = Mock()
+        api_mock.messages.send = Mock(side_effect=vk_call)
+        api_mock.users.get = Mock(side_effect=vk_call)
+        try:
+            bot = self.run_scenario(api_mock, Mock(side_effect=vk_call))
+        finally:
+            with db_session:
+                for entity in (UserState, Ticket, RouteDayStats, FlightSeats):
+                    entity.select().delete(bulk=True)
+
+        # Сообщения на каждое событие, users.get при старте сценария и отправка билета
+        assert len(sessions) == len(self.INPUTS) + 2
+        assert sessions == [None] * len(sessions)
+        # Время удержания соединения записано для каждого события
+        assert len(bot.db_hold_times) == len(self.INPUTS)
+        assert all(hold > 0 for hold in bot.db_hold_times)
+
     def test_image_generation(self):
         with patch('random.sample', return_value='27'):
             with patch('random.choice', return_value='RI11'):
@@ -0,0 +1,92 @@
+import io
+import tempfile
+import unittest
+from unittest.mock import patch, Mock
+import vk_api
+from pony.orm import db_session
+from bot import Bot
+from models import Ticket, RouteDayStats, FlightSeats, init_db
+from ticket_cache import TicketCache
+
+init_db(dict(provider='sqlite', filename=':sharedmemory:'))
+
+
+class MyTestCase(unittest.TestCase):
+    USER_ID = 177327125
+    CONTEXT = {'user_name': 'Дмитрий Смирнов',
+               'departure_city': 'Москва',
+               'destination_city': 'Берлин',
+               'date': '10-08-2021 07:54',
+               'ticket_count': '2',
+               'commentary': 'Комментарий пропущен'}
+
+    def setUp(self):
+        self.bot = Bot('', '', long_poll=False)
+        self.bot.api = Mock()
+        self.bot.api.users.get = Mock(return_value=[{'first_name': 'Дмитрий', 'last_name': 'Смирнов'}])
+        self.bot.uploader = Mock()
+        self.bot.uploader.upload = Mock(return_value='photo1_1')
+        self.bot.ticket_cache = TicketCache(directory=tempfile.mkdtemp())
+
+    def tearDown(self):
+        with db_session:
+            for entity in (Ticket, RouteDayStats, FlightSeats):
+                entity.select().delete(bulk=True)
+
+    def book(self):
+        context = dict(self.CONTEXT)
+        with db_session:
+            self.bot.book(self.USER_ID, context)
+        return context
+
+    def test_key(self):
+        assert TicketCache.key(None) is None
+        assert TicketCache.key(1) != TicketCache.key(2)
+
+    def test_put_get(self):
+        cache = self.bot.ticket_cache
+        cache.put('ticket1', io.BytesIO(b'png'), 'photo1_1')
+
+        assert cache.get_attachment('ticket1') == 'photo1_1'
+        assert cache.get_image('ticket1').getvalue() == b'png'
+        assert cache.get_attachment('ticket2') is None and cache.get_image('ticket2') is None
+
+    def test_same_data_different_bookings(self):
+        first, second = self.book(), self.book()
+        assert first['ticket_id'] != second['ticket_id']
+
+    def test_resend(self):
+        context = self.book()
+        key = TicketCache.key(context['ticket_id'])
+
+        # Первая отправка рендерит и загружает билет
+        with patch('handlers.generate_image', return_value=io.BytesIO(b'png')) as render:
+            self.bot.resend_ticket(self.USER_ID)
+            render.assert_called_once()
+        assert self.bot.ticket_cache.get_attachment(key) == 'photo1_1'
+
+        # Повторная отправка берет вложение из кэша
+        with patch('handlers.generate_image') as render:
+            self.bot.resend_ticket(self.USER_ID)
+            render.assert_not_called()
+        self.bot.uploader.upload.assert_called_once()
+        assert [call[1]['attachment'] for call in self.bot.api.messages.send.call_args_list] == ['photo1_1'] * 2
+
+    def test_resend_rejected_attachment(self):
+        context = self.book()
+        self.bot.ticket_cache.put(TicketCache.key(context['ticket_id']), io.BytesIO(b'png'), 'photo1_1')
+        error = vk_api.ApiError(None, 'messages.send', {}, {}, {'error_code': 100, 'error_msg': ''})
+        self.bot.api.messages.send = Mock(side_effect=[error, None])
+        self.bot.uploader.upload = Mock(return_value='photo1_2')
+
+        # Отклоненное вложение загружается заново из сохраненного изображения, без рендера
+        with patch('handlers.generate_image') as render:
+            self.bot.resend_ticket(self.USER_ID)
+            render.assert_not_called()
+        assert self.bot.uploader.upload.call_args[0][0].getvalue() == b'png'
+        assert self.bot.api.messages.send.call_args[1]['attachment'] == 'photo1_2'
+
+    def test_resend_without_bookings(self):
+        self.bot.resend_ticket(self.USER_ID)
+        self.bot.uploader.upload.assert_not_called()
+        assert 'attachment' not in self.bot.api.messages.send.call_args[1]
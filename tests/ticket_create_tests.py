@@ -0,0 +1,97 @@
+import random
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from PIL import ImageChops
+import ticket_create as tc
+
+
+class MyTestCase(unittest.TestCase):
+    CITIES = ['Москва', 'Берлин', 'Санкт-Петербург', 'Рига', 'Кёльн', 'Нижний Новгород']
+    NAMES = ['Дмитрий Смирнов', 'Anna Müller', 'Иван Петров-Водкин', 'O\'Neil']
+
+    def random_data(self, rnd):
+        dep, dest = rnd.sample(self.CITIES, 2)
+        return {'user_name': rnd.choice(self.NAMES),
+                'departure_city': dep,
+                'destination_city': dest,
+                'date': f'{rnd.randint(1, 28):02}-{rnd.randint(1, 12):02}-2021 {rnd.randint(0, 23):02}:'
+                        f'{rnd.randint(0, 59):02}',
+                'ticket_count': rnd.randint(1, 5)}
+
+    def test_layered_matches_image_draw(self):
+        rnd = random.Random(0)
+        for _ in range(10):
+            data = self.random_data(rnd)
+            data_image = tc.TicketCreator(data).generate_tickets()
+
+            expected = tc.TicketCreator(data).render(data_image).convert('RGB')
+            layered = tc.LayeredTicketCreator(data).render(data_image)
+
+            assert ImageChops.difference(expected, layered).getbbox() is None, data_image
+
+    def test_create_batch(self):
+        data = dict(self.random_data(random.Random(1)), ticket_count=3, seats=[4, 17, 30])
+        creator = tc.LayeredTicketCreator(data)
+
+        tickets = creator.generate_passenger_tickets()
+        assert [ticket['seat'] for ticket in tickets] == ['4', '17', '30']
+        assert {ticket['name'] for ticket in tickets} == {data['user_name']}
+
+        # Без брони места выбираются случайно, но не повторяются
+        del data['seats']
+        tickets = tc.LayeredTicketCreator(dict(data, ticket_count=5)).generate_passenger_tickets()
+        assert len({ticket['seat'] for ticket in tickets}) == 5
+
+        images = creator.create_batch()
+        assert len(images) == 3
+        background = tc.LayeredTicketCreator.layers()[0]
+        for image in images:
+            with tc.Image.open(image) as decoded:
+                assert decoded.size == background.size
+
+    def test_passenger_names(self):
+        data = dict(self.random_data(random.Random(2)), ticket_count=2, seats=[1, 2],
+                    passengers=['Иван Петров', 'Anna Müller'])
+        tickets = tc.LayeredTicketCreator(data).generate_passenger_tickets()
+        assert [(ticket['name'], ticket['seat']) for ticket in tickets] == [('Иван Петров', '1'), ('Anna Müller', '2')]
+
+        data['passengers'] = ['Иван Петров']
+        with self.assertRaises(ValueError):
+            tc.LayeredTicketCreator(data).generate_passenger_tickets()
+
+    def test_create_sheet(self):
+        data = dict(self.random_data(random.Random(3)), ticket_count=4, seats=[1, 2, 3, 4])
+        width, height = tc.LayeredTicketCreator.layers()[0].size
+
+        with tc.Image.open(tc.LayeredTicketCreator(data).create_sheet()) as sheet:
+            assert sheet.size == (width, height * 4)
+
+    def test_concurrent_first_render(self):
+        data = self.random_data(random.Random(4))
+        glyph_cache, errors = tc.GlyphCache, []
+
+        def slow_glyph_cache(*args):
+            # Медленная загрузка шрифтов расширяет окно между созданием фона и шрифтов
+            time.sleep(0.05)
+            return glyph_cache(*args)
+
+        def create():
+            try:
+                tc.LayeredTicketCreator(data).create()
+            except Exception as error:
+                errors.append(error)
+
+        with patch.object(tc.LayeredTicketCreator, 'background', None), \
+                patch.object(tc.LayeredTicketCreator, 'fonts', {}), \
+                patch('ticket_create.GlyphCache', side_effect=slow_glyph_cache) as constructor:
+            threads = [threading.Thread(target=create) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert not errors
+        # Слои построены один раз
+        assert constructor.call_count == len(tc.LayeredTicketCreator.TEXT_POSITIONS)
@@ -0,0 +1,64 @@
+import io
+import time
+import unittest
+from unittest.mock import patch, Mock
+from uploader import PhotoUploader
+
+
+def make_response(photo='[{"photo": 1}]', name='1'):
+    response = Mock()
+    response.json = Mock(return_value={'server': 1, 'photo': photo, 'hash': name})
+    return response
+
+
+class MyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.api = Mock()
+        self.api.photos.getMessagesUploadServer = Mock(side_effect=lambda: {'upload_url': f'url{self.urls}'})
+        self.api.photos.saveMessagesPhoto = Mock(side_effect=lambda **data: [{'owner_id': 1, 'id': data['hash']}])
+        self.urls = 1
+        self.uploader = PhotoUploader(self.api, url_ttl=600)
+        self.uploader.session = Mock()
+
+    def test_upload_url_cached(self):
+        self.uploader.session.post = Mock(return_value=make_response())
+        with patch('uploader.time.monotonic', return_value=0):
+            self.uploader.upload(io.BytesIO(b'1'))
+            self.uploader.upload(io.BytesIO(b'2'))
+        assert self.api.photos.getMessagesUploadServer.call_count == 1
+
+        # После url_ttl адрес запрашивается заново
+        self.urls = 2
+        with patch('uploader.time.monotonic', return_value=600):
+            self.uploader.upload(io.BytesIO(b'3'))
+        assert self.api.photos.getMessagesUploadServer.call_count == 2
+        assert self.uploader.session.post.call_args[1]['url'] == 'url2'
+
+    def test_rejected_upload_retried(self):
+        self.uploader.session.post = Mock(side_effect=[make_response(photo='[]'), make_response(name='7')])
+        image = io.BytesIO(b'png')
+        image.read()
+
+        assert self.uploader.upload(image) == 'photo1_7'
+        assert self.api.photos.getMessagesUploadServer.call_count == 2
+        # Повторная отправка идет с начала файла
+        assert image.tell() == 0
+
+    def test_rejected_twice(self):
+        self.uploader.session.post = Mock(return_value=make_response(photo='[]'))
+        with self.assertRaises(ValueError):
+            self.uploader.upload(io.BytesIO(b'png'))
+        self.api.photos.saveMessagesPhoto.assert_not_called()
+
+    def test_upload_many_order(self):
+        def post(url, files, timeout):
+            name = files['photo'][1].getvalue().decode()
+            # Первые изображения загружаются дольше последних
+            time.sleep(0.01 * (5 - int(name)))
+            return make_response(name=name)
+
+        self.uploader.session.post = Mock(side_effect=post)
+        attachments = self.uploader.upload_many([io.BytesIO(str(i).encode()) for i in range(5)])
+
+        assert attachments == [f'photo1_{i}' for i in range(5)]
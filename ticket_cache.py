@@ -0,0 +1,129 @@
+"""
+Модуль дискового кэша билетов
+
+    TicketCache - кэш изображений билетов и вложений ВКонтакте, адресуемый id брони (models.Ticket),
+    с вытеснением давно не использованных записей при превышении размера
+
+Кэш читается при повторной отправке билета (Bot.resend_ticket): сначала готовое вложение,
+затем сохраненное изображение, которое загружается снова без повторного рендера.
+"""
+
+import json
+import os
+from io import BytesIO
+from pathlib import Path
+from threading import Lock
+
+BASEDIR = Path(__file__).resolve().parent
+
+
+class TicketCache:
+    """
+    Класс кэша билетов.
+    Для каждой брони хранит файлы <key>.png (изображение) и <key>.json (строка вложения photo{owner}_{id}).
+    Время последнего обращения хранится в mtime файлов, при превышении max_bytes удаляются самые старые записи.
+    """
+
+    def __init__(self, directory=BASEDIR/'files/ticket_cache', max_bytes=100 * 2 ** 20):
+        # Относительный путь отсчитывается от папки проекта
+        self.directory = BASEDIR / directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.size = sum(path.stat().st_size for path in self.directory.iterdir())
+
+    @staticmethod
+    def key(ticket_id):
+        """
+        Функция вычисления ключа брони.
+        Ключ - id записи Ticket: он различает разные брони и разных пользователей, даже если данные брони
+        совпадают, а случайный номер рейса и места на билете закреплены за бронью после первого рендера
+
+        @param ticket_id: id брони, None - билет не из брони и не кэшируется
+        @return: ключ или None
+        """
+        return None if ticket_id is None else f'ticket{ticket_id}'
+
+    def path(self, key, suffix):
+        return self.directory / f'{key}{suffix}'
+
+    def touch(self, *paths):
+        for path in paths:
+            if path.exists():
+                os.utime(path)
+
+    def get_attachment(self, key):
+        """
+        Функция получения вложения ВКонтакте для брони
+
+        @param key: ключ брони
+        @return: строка вложения или None, если билета нет в кэше
+        """
+        path = self.path(key, '.json')
+        try:
+            with open(path, mode='r', encoding='utf8') as ff:
+                attachment = json.load(ff)['attachment']
+        except (OSError, ValueError, KeyError):
+            return None
+        self.touch(path, self.path(key, '.png'))
+        return attachment
+
+    def get_image(self, key):
+        """
+        Функция получения изображения билета
+
+        @param key: ключ брони
+        @return: BytesIO с png-изображением или None
+        """
+        path = self.path(key, '.png')
+        try:
+            image = BytesIO(path.read_bytes())
+        except OSError:
+            return None
+        self.touch(path, self.path(key, '.json'))
+        return image
+
+    def put(self, key, image, attachment):
+        """
+        Функция сохранения билета в кэш
+
+        @param key: ключ брони
+        @param image: BytesIO с изображением, None - сохранить только вложение
+        @param attachment: строка вложения ВКонтакте
+        """
+        with self.lock:
+            files = {'.json': json.dumps({'attachment': attachment}).encode('utf8')}
+            if image is not None:
+                files['.png'] = image.getvalue()
+
+            for suffix, content in files.items():
+                path = self.path(key, suffix)
+                if path.exists():
+                    self.size -= path.stat().st_size
+                # Пишем во временный файл и переименовываем, чтобы читатели не видели файл наполовину
+                temp_path = self.path(key, suffix + '.tmp')
+                temp_path.write_bytes(content)
+                os.replace(temp_path, path)
+                self.size += len(content)
+
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Группируем файлы по ключу и удаляем записи с самым старым временем обращения,
+        # пока кэш не станет меньше 90% лимита
+        entries = {}
+        for path in self.directory.iterdir():
+            stat = path.stat()
+            paths, mtime = entries.get(path.stem, ([], 0))
+            entries[path.stem] = (paths + [(path, stat.st_size)], max(mtime, stat.st_mtime))
+
+        for paths, _ in sorted(entries.values(), key=lambda entry: entry[1]):
+            if self.size <= self.max_bytes * 0.9:
+                break
+            for path, size in paths:
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                self.size -= size
@@ -1,5 +1,8 @@
 import datetime as dt
 import random
+import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from pathlib import Path
 from PIL import ImageDraw, Image, ImageFont
@@ -12,6 +15,8 @@ BASEDIR = Path(__file__).resolve().parent
 class TicketCreator:
     TIMEFORMAT = '%d-%m-%Y %H:%M'
     FLITHS = ['SU9', 'RI11', 'JS08', 'BY3', 'KO5', 'CV11']
+    # Уровень сжатия png по умолчанию в Pillow
+    COMPRESS_LEVEL = 6
 
     TEXT_POSITIONS = {
         str(BASEDIR/'files/Roboto-Bold.ttf'): {
@@ -36,7 +41,8 @@ class TicketCreator:
     def generate_tickets(self):
         datetime = dt.datetime.strptime(self.data['date'], self.TIMEFORMAT)
         board, last_call = (datetime - dt.timedelta(minutes=40)).time(), (datetime - dt.timedelta(minutes=20)).time()
-        seats = random.sample(range(1, 55), int(self.data['ticket_count']))
+        # Места выдает модуль seats при бронировании, случайные - если билет создается без брони
+        seats = self.data.get('seats') or random.sample(range(1, 55), int(self.data['ticket_count']))
 
         return {'name': self.data['user_name'],
                 'dep': self.data['departure_city'],
@@ -48,23 +54,183 @@ class TicketCreator:
                 'board': board.strftime('%H:%M'),
                 'last_call': last_call.strftime('%H:%M')}
 
-    def create(self):
+    def render(self, data_image):
         image = Image.open(normpath(BASEDIR/'files/ticket.jpg'))
         draw = ImageDraw.Draw(image)
-        data_image = self.generate_tickets()
 
         for fp, elements in self.TEXT_POSITIONS.items():
             font = ImageFont.truetype(normpath(fp), 18)
             for name, positions in elements.items():
                 for pos in positions:
                     draw.text(pos, str(data_image[name]), font=font, fill=(0, 0, 0))
+        return image
 
+    def encode(self, image):
         temp_file = BytesIO()
-        image.save(temp_file, 'png')
+        image.save(temp_file, 'png', compress_level=self.COMPRESS_LEVEL)
         temp_file.seek(0)
-
         return temp_file
 
+    def create(self):
+        return self.encode(self.render(self.generate_tickets()))
+
+
+class GlyphCache:
+    """
+    Кэш растровых масок символов и целых слов для одного шрифта.
+    Символы (цифры, латиница, кириллица, пунктуация) рендерятся один раз при создании,
+    слова (например, названия городов) - при первом использовании или через warm.
+    """
+
+    ALPHABET = (string.digits + string.ascii_letters + ' -:,.()/'
+                + 'АБВГДЕЁЖЗИЙКЛМНОПРСТУФХЦЧШЩЪЫЬЭЮЯабвгдеёжзийклмнопрстуфхцчшщъыьэюя')
+    MAX_WORDS = 1024
+
+    def __init__(self, font_path, size=18):
+        self.font = ImageFont.truetype(normpath(font_path), size)
+        self.glyphs = {char: self.render_mask(char) for char in self.ALPHABET}
+        self.words = {}
+
+    def render_mask(self, text):
+        """
+        Функция рендера текста в маску
+
+        @param text: строка для рендера
+        @return: (маска в режиме 'L', смещение маски относительно точки вывода, ширина строки)
+        """
+        left, top, right, bottom = self.font.getbbox(text)
+        mask = Image.new('L', (max(right - left, 1), max(bottom - top, 1)))
+        ImageDraw.Draw(mask).text((-left, -top), text, font=self.font, fill=255)
+        return mask, (left, top), self.font.getlength(text)
+
+    def warm(self, words):
+        for word in words:
+            self.word(word)
+
+    def word(self, text):
+        mask = self.words.get(text)
+        if mask is None:
+            if len(self.words) >= self.MAX_WORDS:
+                self.words.clear()
+            mask = self.words[text] = self.render_mask(text)
+        return mask
+
+    def draw(self, image, position, text, fill, whole=False):
+        """
+        Функция вывода строки на изображение готовыми масками
+
+        @param image: изображение для вывода
+        @param position: точка вывода, как у ImageDraw.text
+        @param text: строка
+        @param fill: цвет текста
+        @param whole: True - строка кэшируется целиком как слово, иначе собирается из символов
+        """
+        if whole:
+            pieces = [self.word(text)]
+        else:
+            # Символы вне алфавита рендерятся и кэшируются как слова
+            pieces = [self.glyphs.get(char) or self.word(char) for char in text]
+
+        x, y = position
+        for mask, (left, top), advance in pieces:
+            image.paste(fill, (round(x) + left, y + top), mask)
+            x += advance
+
+
+class LayeredTicketCreator(TicketCreator):
+    """
+    Класс генерации билета из закэшированных слоев.
+    Фон декодируется один раз на процесс, текст собирается из масок GlyphCache,
+    поэтому на каждый билет приходятся только копирование фона, наложение масок и кодирование png.
+    """
+
+    # Поля, значения которых повторяются между билетами и кэшируются целиком
+    WORD_FIELDS = ('dep', 'des', 'flight')
+    # Быстрое сжатие: png немного больше, зато кодирование в несколько раз быстрее
+    COMPRESS_LEVEL = 1
+
+    background = None
+    fonts = {}
+    layers_lock = threading.Lock()
+
+    @classmethod
+    def layers(cls):
+        # Билеты рендерятся из нескольких потоков обработки событий: слои строятся один раз под блокировкой,
+        # а fonts присваивается раньше background, чтобы поток без блокировки не увидел фон без шрифтов
+        if cls.background is None:
+            with cls.layers_lock:
+                if cls.background is None:
+                    with Image.open(normpath(BASEDIR/'files/ticket.jpg')) as image:
+                        background = image.convert('RGB')
+                    cls.fonts = {fp: GlyphCache(fp, 18) for fp in cls.TEXT_POSITIONS}
+                    cls.background = background
+        return cls.background, cls.fonts
+
+    @classmethod
+    def warm(cls, cities):
+        """
+        Функция предварительного рендера названий городов
+
+        @param cities: список городов из расписания
+        """
+        for glyphs in cls.layers()[1].values():
+            glyphs.warm(cities)
+
+    def render(self, data_image):
+        background, fonts = self.layers()
+        image = background.copy()
+        for fp, elements in self.TEXT_POSITIONS.items():
+            glyphs = fonts[fp]
+            for name, positions in elements.items():
+                for pos in positions:
+                    glyphs.draw(image, pos, str(data_image[name]), (0, 0, 0), whole=name in self.WORD_FIELDS)
+        return image
+
+    def generate_passenger_tickets(self):
+        """
+        Функция генерации данных билетов для каждого пассажира брони.
+        Имена пассажиров берутся из data['passengers'], если сценарий их собрал,
+        иначе на всех билетах указывается имя покупателя (user_name)
+
+        @return: список словарей как у generate_tickets, с общим рейсом и разными местами
+        """
+        common = self.generate_tickets()
+        seats = common['seat'].split(', ')
+        names = self.data.get('passengers') or [self.data['user_name']] * len(seats)
+        if len(names) != len(seats):
+            raise ValueError(f'passengers: {len(names)}, seats: {len(seats)}')
+
+        return [dict(common, name=name, seat=seat) for name, seat in zip(names, seats)]
+
+    def create_batch(self, workers=4):
+        """
+        Функция генерации отдельного билета на каждого пассажира за один вызов.
+        Отрисовка использует общие слои, кодирование png выполняется в нескольких потоках
+
+        @param workers: количество потоков кодирования
+        @return: список BytesIO с png-изображениями
+        """
+        images = [self.render(data_image) for data_image in self.generate_passenger_tickets()]
+        if len(images) < 2:
+            return [self.encode(image) for image in images]
+
+        with ThreadPoolExecutor(max_workers=min(workers, len(images))) as executor:
+            return list(executor.map(self.encode, images))
+
+    def create_sheet(self):
+        """
+        Функция генерации одного изображения, на котором билеты пассажиров расположены друг под другом
+
+        @return: BytesIO с png-изображением
+        """
+        images = [self.render(data_image) for data_image in self.generate_passenger_tickets()]
+        width, height = images[0].size
+        sheet = Image.new('RGB', (width, height * len(images)))
+        for index, image in enumerate(images):
+            sheet.paste(image, (0, height * index))
+
+        return self.encode(sheet)
+
 
 if __name__ == '__main__':
     TicketCreator({})
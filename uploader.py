@@ -0,0 +1,90 @@
+"""
+Модуль загрузки фотографий в сообщения ВКонтакте
+
+    PhotoUploader - загрузка изображений через общий пул keep-alive соединений
+    с кэшированием адреса сервера загрузки
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class PhotoUploader:
+    """
+    Класс загрузки изображений билетов.
+    Держит одну requests.Session с пулом соединений, поэтому TCP+TLS рукопожатие выполняется
+    один раз на соединение, а не на каждый билет. Адрес из photos.getMessagesUploadServer
+    запоминается на url_ttl секунд и сбрасывается при ошибке загрузки.
+    """
+
+    def __init__(self, api, url_ttl=600, pool_size=5, timeout=30):
+        self.api = api
+        self.url_ttl, self.pool_size, self.timeout = url_ttl, pool_size, timeout
+        self.upload_url, self.url_expires = None, 0.0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def get_upload_url(self):
+        """
+        Функция получения адреса сервера загрузки
+
+        @return: закэшированный адрес, либо новый, если срок кэша истек
+        """
+        if self.upload_url is None or time.monotonic() >= self.url_expires:
+            self.upload_url = self.api.photos.getMessagesUploadServer()['upload_url']
+            self.url_expires = time.monotonic() + self.url_ttl
+        return self.upload_url
+
+    def reset_upload_url(self):
+        self.upload_url, self.url_expires = None, 0.0
+
+    def post(self, image):
+        response = self.session.post(url=self.get_upload_url(),
+                                     files={'photo': ('image.png', image, 'image/png')},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+        upload_data = response.json()
+        # Сервер загрузки отвечает пустым photo, если адрес устарел
+        if not upload_data.get('photo') or upload_data['photo'] == '[]':
+            raise ValueError('upload server rejected photo')
+        return upload_data
+
+    def upload(self, image):
+        """
+        Функция загрузки одного изображения
+
+        @param image: файлоподобный объект с png-изображением
+        @return: строка вложения в формате photo{owner_id}_{id}
+        """
+        try:
+            upload_data = self.post(image)
+        except (requests.RequestException, ValueError):
+            # Возможно, адрес сервера устарел раньше срока: получаем новый и пробуем еще раз
+            self.reset_upload_url()
+            image.seek(0)
+            upload_data = self.post(image)
+
+        image_data = self.api.photos.saveMessagesPhoto(**upload_data)
+        return f"photo{image_data[0]['owner_id']}_{image_data[0]['id']}"
+
+    def upload_many(self, images):
+        """
+        Функция параллельной загрузки нескольких изображений
+
+        @param images: список файлоподобных объектов с png-изображениями
+        @return: список строк вложений в том же порядке
+        """
+        if len(images) < 2:
+            return [self.upload(image) for image in images]
+
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(images))) as executor:
+            return list(executor.map(self.upload, images))
+
+    def close(self):
+        self.session.close()